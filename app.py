@@ -1,16 +1,46 @@
-from flask import Flask, Response, render_template, request, redirect, url_for, send_from_directory, jsonify, send_file
+from flask import Flask, Response, render_template, request, redirect, url_for, send_from_directory, jsonify, send_file, has_request_context, g
 from werkzeug.utils import secure_filename
 from PIL import Image
 from PIL import ExifTags
-from pathlib import Path
+try:
+    import pillow_avif  # noqa: F401  (registers AVIF on Pillow builds without it)
+except ImportError:
+    pass
 import os
 import json
 import subprocess
 import random
 import time
+import math
 import logging
 import threading
-import requests
+import heapq
+import bisect
+import itertools
+import queue
+import uuid
+import base64
+from types import MappingProxyType
+import hashlib
+import sqlite3
+import sys
+import argparse
+import signal
+import shutil
+import socket
+import runpy
+import traceback
+import fcntl
+import contextlib
+import atexit
+import functools
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
+try:
+    import numpy as np  # vectorised weighted shuffle for large libraries
+except ImportError:
+    np = None
 
 config_lock = threading.Lock()
 app = Flask(__name__)
@@ -31,72 +61,972 @@ allowed_scripts = {
 clock_process = None
 clock_timer = None
 active_clock_name = None
-BASE_DIR = os.path.abspath(os.path.dirname(__file__))
+current_image_path = None
+BASE_DIR = os.environ.get('FRAME_BASE_DIR') or os.path.abspath(os.path.dirname(__file__))  # override for bench.py
 UPLOAD_ROOT = os.path.join(BASE_DIR, 'static', 'uploads')
 THUMB_ROOT = os.path.join(BASE_DIR, 'static', 'thumbs')
 SYMLINK_PATH = os.path.join(BASE_DIR, 'static', 'current.jpg')
+DISPLAY_CACHE_ROOT = os.path.join(BASE_DIR, 'static', 'display_cache')
 CONFIG_PATH = os.path.join(BASE_DIR, 'config.json')
 
+ORDER_PATH = os.path.join(BASE_DIR, 'image_order.txt')
+SLIDESHOW_LIST_PATH = os.path.join(BASE_DIR, 'slideshow_list.txt')
+CURRENT_IMAGE_PATH = os.path.join(BASE_DIR, 'static', 'current_image.txt')  # legacy, migrated into STATE_PATH
+STATE_PATH = os.path.join(BASE_DIR, 'state.json')
+RUN_DIR = os.path.join(BASE_DIR, 'run')  # locks and sockets shared by worker processes
+
+# --- Metrics ---
+class Metrics:
+    """Prometheus counters and histograms kept in memory and rendered at /metrics.
+
+    An update is a dict lookup and a couple of additions under one lock, so
+    this stays on in production. Series are per process: under several
+    workers each one reports its own.
+    """
+
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    METRICS = {
+        'frame_http_request_duration_seconds': ('histogram', 'Request latency by route.'),
+        'frame_image_decode_seconds': ('histogram', 'Image decode time by pipeline.'),
+        'frame_image_encode_seconds': ('histogram', 'Image encode time by pipeline.'),
+        'frame_thumbnail_requests_total': ('counter', 'Thumbnail requests by result (hit, miss, not_modified).'),
+        'frame_subprocess_spawns_total': ('counter', 'Subprocesses started, by command.'),
+        'frame_subprocess_seconds': ('histogram', 'Subprocess run time, or spawn time for long-running ones.'),
+        'frame_scheduler_lag_seconds': ('histogram', 'How late scheduled jobs (e.g. the slideshow tick) ran.'),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.BUCKETS, value)
+        with self._lock:
+            series = self._series.setdefault(name, {})
+            buckets = series.get(key)
+            if buckets is None:
+                buckets = series[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            buckets[index] += 1
+            buckets[-1] += value
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @staticmethod
+    def _labels(pairs):
+        if not pairs:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+    def render(self, extra=()):
+        """Text exposition format; `extra` adds (name, kind, help, {labels: value}) series."""
+        with self._lock:
+            snapshot = {name: {key: list(value) if isinstance(value, list) else value
+                               for key, value in series.items()}
+                        for name, series in self._series.items()}
+
+        families = [(name, kind, text, snapshot.get(name, {})) for name, (kind, text) in self.METRICS.items()]
+        lines = []
+        for name, kind, text, series in families + list(extra):
+            lines += [f"# HELP {name} {text}", f"# TYPE {name} {kind}"]
+            for key, value in sorted(series.items()):
+                if kind != 'histogram':
+                    lines.append(f"{name}{self._labels(key)} {value}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + ('+Inf',), value[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(key + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(key)} {value[-1]:.6f}")
+                lines.append(f"{name}_count{self._labels(key)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def run_command(argv, **kwargs):
+    """subprocess.run, counted and timed per command in /metrics."""
+    command = os.path.basename(argv[0])
+    metrics.inc('frame_subprocess_spawns_total', command=command)
+    with metrics.timer('frame_subprocess_seconds', command=command):
+        return subprocess.run(argv, **kwargs)
+
+def spawn_command(argv, **kwargs):
+    """subprocess.Popen for long-running children; only the fork/exec is timed."""
+    command = os.path.basename(argv[0])
+    metrics.inc('frame_subprocess_spawns_total', command=command)
+    with metrics.timer('frame_subprocess_seconds', command=command):
+        return subprocess.Popen(argv, **kwargs)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_request(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe('frame_http_request_duration_seconds', time.perf_counter() - started,
+                        route=route, method=request.method)
+    return response
+
+# --- Storage write accounting ---
+class WriteLedger:
+    """Counts bytes, fsyncs and renames per endpoint or background task, against a daily budget.
+
+    The source is the Flask endpoint on request threads and the thread name
+    otherwise. Once today's bytes pass 'write_budget_mb_per_day' in config,
+    writes marked non-critical are held in memory, coalesced per path and
+    flushed every `batch_seconds`, and rebuildable caches stop writing.
+    """
+
+    def __init__(self, batch_seconds=60):
+        self.batch_seconds = batch_seconds
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.sources = {}
+        self.day = time.strftime('%Y-%m-%d')
+        self.day_bytes = 0
+        self.deferred = {}
+        self.deferred_total = 0
+        self._flusher = None
+
+    @staticmethod
+    def source():
+        if has_request_context():
+            return request.endpoint or request.path
+        return threading.current_thread().name
+
+    def _roll(self):
+        today = time.strftime('%Y-%m-%d')
+        if today != self.day:
+            self.day, self.day_bytes = today, 0
+
+    def record(self, nbytes, fsyncs=0, renames=0, source=None):
+        source = source or self.source()
+        with self._lock:
+            self._roll()
+            counts = self.sources.setdefault(source, {'writes': 0, 'bytes': 0, 'fsyncs': 0, 'renames': 0})
+            counts['writes'] += 1
+            counts['bytes'] += nbytes
+            counts['fsyncs'] += fsyncs
+            counts['renames'] += renames
+            self.day_bytes += nbytes
+
+    def totals(self):
+        with self._lock:
+            return {key: sum(counts[key] for counts in self.sources.values())
+                    for key in ('writes', 'bytes', 'fsyncs', 'renames')}
+
+    def budget_bytes(self):
+        budget_mb = load_config().get('write_budget_mb_per_day')
+        return int(budget_mb * 1024 * 1024) if budget_mb else None
+
+    def over_budget(self):
+        budget = self.budget_bytes()
+        if budget is None:
+            return False
+        with self._lock:
+            self._roll()
+            return self.day_bytes >= budget
+
+    def defer(self, path, text):
+        """Hold a non-critical write; a later write to the same path replaces it."""
+        with self._lock:
+            self.deferred[path] = text
+            self.deferred_total += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='write-flush', daemon=True)
+                self._flusher.start()
+
+    def discard(self, path):
+        with self._lock:
+            self.deferred.pop(path, None)
+
+    def flush(self):
+        with self._lock:
+            pending, self.deferred = self.deferred, {}
+        for path, text in pending.items():
+            try:
+                write_atomic(path, text)
+            except Exception as e:
+                app.logger.warning(f"Deferred write to {path} failed: {e}")
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.batch_seconds)
+            self.flush()
+
+    def stats(self):
+        budget = self.budget_bytes()
+        totals = self.totals()
+        with self._lock:
+            self._roll()
+            uptime = max(time.time() - self.started, 1.0)
+            return {
+                'since': self.started,
+                'totals': totals,
+                'rates_per_hour': {key: round(value * 3600 / uptime, 1) for key, value in totals.items()},
+                'today': {'date': self.day, 'bytes': self.day_bytes, 'budget_bytes': budget,
+                          'over_budget': budget is not None and self.day_bytes >= budget},
+                'deferred': {'pending': len(self.deferred), 'total': self.deferred_total},
+                'sources': dict(sorted(self.sources.items(), key=lambda item: -item[1]['bytes'])),
+            }
+
+ledger = WriteLedger()
+atexit.register(ledger.flush)
+
+def write_atomic(path, text, critical=True):
+    """Write text to a temp file and rename it over path so readers never see a partial file.
+
+    Non-critical writes are batched by the ledger once the daily write budget is spent.
+    """
+    if not critical and ledger.over_budget():
+        ledger.defer(path, text)
+        return
+    ledger.discard(path)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+    ledger.record(len(text.encode()), fsyncs=1, renames=1)
+
+def save_image(img, path, *args, **kwargs):
+    """img.save() beside path and rename over it, counting the bytes in the ledger."""
+    # Unique per writer: a request and the variant queue may encode the same file at once
+    temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{os.getpid()}-{threading.get_ident()}.tmp")
+    img.save(temp_path, *args, **kwargs)
+    nbytes = os.path.getsize(temp_path)
+    os.replace(temp_path, path)
+    ledger.record(nbytes, renames=1)
+    return path
+
+# Playlists are a snapshot file plus an append-only log of edits since it was
+# written (image_order.txt + image_order.log). Small edits cost one appended
+# line; the log is folded back into the snapshot every PLAYLIST_COMPACT_OPS.
+PLAYLIST_COMPACT_OPS = 500
+
+def playlist_log_path(list_path):
+    return os.path.splitext(list_path)[0] + '.log'
+
+def compact_playlist(list_path, images):
+    """Write a fresh snapshot and drop the log it supersedes."""
+    write_atomic(list_path, '\n'.join(images))
+    try:
+        os.remove(playlist_log_path(list_path))
+    except FileNotFoundError:
+        pass
+
+def append_playlist_log(list_path, ops):
+    """Append edits as tab-separated lines: `+ pos name`, `- name` or `> pos name` (move)."""
+    lines = []
+    for op in ops:
+        lines.append('\t'.join(str(field) for field in op) + '\n')
+    text = ''.join(lines)
+    with open(playlist_log_path(list_path), 'a') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    ledger.record(len(text.encode()), fsyncs=1)
+
+def read_playlist(list_path):
+    """(images, number of log entries replayed) for a snapshot plus its log.
+
+    Replay is idempotent, so a log left behind by a crash between snapshot and
+    log removal does no harm.
+    """
+    images = []
+    try:
+        with open(list_path) as f:
+            images = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        pass
+
+    replayed = 0
+    try:
+        with open(playlist_log_path(list_path)) as f:
+            log = f.read().splitlines()
+    except FileNotFoundError:
+        log = []
+    if log:
+        present = set(images)
+        for line in log:
+            op, _, rest = line.partition('\t')
+            if op == '-':
+                if rest in present:
+                    images.remove(rest)
+                    present.discard(rest)
+            elif op in ('+', '>'):
+                pos, _, name = rest.partition('\t')
+                if not name or not pos.lstrip('-').isdigit():
+                    continue  # torn final line
+                if name in present:
+                    if op == '+':
+                        continue
+                    images.remove(name)
+                images.insert(min(max(int(pos), 0), len(images)), name)
+                present.add(name)
+            else:
+                continue
+            replayed += 1
+    return images, replayed
+
+@contextlib.contextmanager
+def file_lock(name):
+    """Exclusive flock on RUN_DIR/<name>.lock, held across threads and worker processes."""
+    os.makedirs(RUN_DIR, exist_ok=True)
+    with open(os.path.join(RUN_DIR, f"{name}.lock"), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def disk_stamp(path):
+    """(mtime_ns, size) of path, or None if it is missing; cheap change detection."""
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
 def create_slideshow_list(folder, images):
-    list_path = os.path.join(BASE_DIR, 'slideshow_list.txt')
     try:
-        with open(list_path, 'w') as f:
-            f.write('\n'.join(images))
-            f.flush()
-            os.fsync(f.fileno())
+        compact_playlist(SLIDESHOW_LIST_PATH, images)
     except Exception as e:
         app.logger.error(f"Failed to create slideshow_list.txt: {e}")
 
-def launch_zoom_viewer():
-    subprocess.Popen([
-        "feh", "--fullscreen", "--title", "feh-zoom", "/home/pi/frame-app/static/current.jpg"
-    ])
-
-def send_zoom(direction="in"):
-    key = "Up" if direction == "in" else "Down"
+def write_image_order(images):
     try:
-        win_id = subprocess.check_output([
-            "xdotool", "search", "--name", "feh-zoom"
-        ]).decode().strip().split('\n')[0]
-        subprocess.run(["xdotool", "windowactivate", win_id])
-        for _ in range(3):
-            subprocess.run(["xdotool", "key", "--window", win_id, key])
-        return True
-    except:
-        return False
+        compact_playlist(ORDER_PATH, images)
+    except Exception as e:
+        app.logger.error(f"Failed to write image_order.txt: {e}")
 
-def retire_zoom_viewer():
-    subprocess.run(["pkill", "-f", "feh.*feh-zoom"])
+def upcoming_position(cursor, length, rng=random):
+    """Random slot after the cursor, weighted towards the near future.
+
+    Squaring a uniform draw puts half of new photos in the first quarter of the
+    remaining cycle, so uploads show up soon without all landing next.
+    """
+    start = cursor + 1 if cursor >= 0 else 0
+    return start + int((length - start + 1) * rng.random() ** 2)
+
+
+# --- Resident playlist ---
+class Playlist:
+    """In-memory copy of the active slideshow order.
+
+    The list is read from disk once per folder; a name -> position map and a
+    cursor make next/previous/seek O(1) regardless of library size. Inserts
+    and removals are appended to the playlist log rather than rewriting it.
+
+    Other worker processes may edit the same files: sync() (run by ensure())
+    reloads the list when its files change and re-seeks when another worker
+    recorded a transition in the state journal, and edits are made under the 'playlist' file lock.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.folder = None
+        self.images = []
+        self.positions = {}
+        self.cursor = -1
+        self.logged = 0
+        self._list_seen = None
+        self.pending_index = []  # (name, before) inserts held for flush_index
+
+    @staticmethod
+    def list_path(folder):
+        return ORDER_PATH if folder == 'main' else SLIDESHOW_LIST_PATH
+
+    def _set(self, folder, images, current=None):
+        self.folder = folder
+        self.images = list(images)
+        self.positions = {name: i for i, name in enumerate(self.images)}
+        self.cursor = self.positions.get(current, -1)
+
+    def _list_stamp(self, folder=None):
+        list_path = self.list_path(folder or self.folder)
+        return disk_stamp(list_path), disk_stamp(playlist_log_path(list_path))
+
+    def _persist(self):
+        if self.folder == 'main':
+            write_image_order(self.images)
+        else:
+            create_slideshow_list(self.folder, self.images)
+        self.logged = 0
+        self._list_seen = self._list_stamp()
+
+    def _log(self, ops):
+        """Record edits in the playlist log, compacting once it grows long."""
+        if self.logged + len(ops) >= PLAYLIST_COMPACT_OPS:
+            self._persist()
+            return
+        try:
+            append_playlist_log(self.list_path(self.folder), ops)
+            self.logged += len(ops)
+            self._list_seen = self._list_stamp()
+        except Exception as e:
+            app.logger.error(f"Failed to append to playlist log: {e}")
+            self._persist()
+
+    @staticmethod
+    def _index_edits(folder, inserts=(), removes=()):
+        """Mirror edits to 'main' into its stored random order, which Browse's 'random' sort reads."""
+        if folder != 'main' or not (inserts or removes):
+            return
+        try:
+            library_index.edit_order('main', 'random', inserts, removes)
+        except Exception as e:
+            app.logger.warning(f"Failed to update indexed image order: {e}")
+
+    def _index_inserts(self, folder, placements, defer):
+        if defer and folder == 'main':
+            self.pending_index += placements
+        else:
+            self._index_edits(folder, inserts=placements)
+
+    def flush_index(self):
+        """Write inserts held back by insert_upcoming(defer_index=True) in one transaction."""
+        with self.lock:
+            pending, self.pending_index = self.pending_index, []
+        self._index_edits('main', inserts=pending)
+
+    def load(self, folder):
+        """Read the folder's playlist (snapshot plus log) and the last shown image from disk."""
+        with self.lock:
+            images, logged = [], 0
+            # Stamped before reading, so a change made mid-read is picked up next time
+            self._list_seen = self._list_stamp(folder)
+            try:
+                images, logged = read_playlist(self.list_path(folder))
+            except Exception as e:
+                app.logger.error(f"Failed to read playlist for '{folder}': {e}")
+
+            current = state_journal.current().get('image')
+            self._set(folder, images, current)
+            self.logged = logged
+
+    def ensure(self, folder):
+        """Make sure the resident list belongs to folder and is current, loading it if needed."""
+        with self.lock:
+            if folder != self.folder:
+                self.load(folder)
+            else:
+                self.sync()
+
+    def sync(self):
+        """Adopt list edits or cursor moves another worker made on disk."""
+        with self.lock:
+            if self.folder is None:
+                return
+            if self._list_stamp() != self._list_seen:
+                self.load(self.folder)
+                return
+            if state_journal.changed():
+                name = state_journal.current().get('image')
+                self.cursor = self.positions.get(name, self.cursor)
+
+    def replace(self, folder, images, activate=True):
+        """Persist a new order for folder; adopt it if active (or activate=True)."""
+        with self.lock, file_lock('playlist'):
+            if activate or folder == self.folder:
+                current = self.current() if folder == self.folder else None
+                self._set(folder, images, current)
+                self._persist()
+            elif folder == 'main':
+                write_image_order(images)
+            else:
+                create_slideshow_list(folder, images)
+
+    def current(self):
+        with self.lock:
+            return self.images[self.cursor] if 0 <= self.cursor < len(self.images) else None
+
+    def step(self, offset):
+        """Move the cursor by offset (wrapping) and return the new current name."""
+        with self.lock:
+            if not self.images:
+                return None
+            if self.cursor < 0:
+                self.cursor = 0
+            else:
+                self.cursor = (self.cursor + offset) % len(self.images)
+            return self.images[self.cursor]
+
+    def peek(self, offset=1):
+        """Return the name offset entries from the cursor without moving it."""
+        with self.lock:
+            if not self.images:
+                return None
+            if self.cursor < 0:
+                return self.images[0]
+            return self.images[(self.cursor + offset) % len(self.images)]
+
+    def seek(self, name):
+        """Point the cursor at name; returns False if it is not in the list."""
+        with self.lock:
+            idx = self.positions.get(name)
+            if idx is None:
+                return False
+            self.cursor = idx
+            return True
+
+    def index_of(self, name):
+        with self.lock:
+            return self.positions.get(name, -1)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.images), self.cursor
+
+    def remove(self, name):
+        """Drop name from the list, keep the cursor on the same slot and log it."""
+        with self.lock, file_lock('playlist'):
+            self.sync()
+            idx = self.positions.pop(name, None)
+            if idx is None:
+                return False
+            del self.images[idx]
+            for i in range(idx, len(self.images)):
+                self.positions[self.images[i]] = i
+
+            if idx < self.cursor:
+                self.cursor -= 1
+            elif idx == self.cursor:
+                # The following image slides into the deleted slot
+                self.cursor = min(self.cursor, len(self.images) - 1)
+
+            self._log([('-', name)])
+            self.flush_index()
+            self._index_edits(self.folder, removes=[name])
+            return True
+
+    def insert_upcoming(self, folder, names, defer_index=False):
+        """Slot new photos in at weighted-random positions ahead of the cursor.
+
+        Works on the resident list when folder is playing; otherwise 'main' is
+        edited on disk through its log so uploads join the next cycle too.
+        With defer_index the stored random order is only updated by flush_index.
+        """
+        with self.lock, file_lock('playlist'):
+            if folder == self.folder:
+                self.sync()
+                ops, placements = [], []
+                for name in names:
+                    if name in self.positions:
+                        continue
+                    pos = upcoming_position(self.cursor, len(self.images))
+                    self.images.insert(pos, name)
+                    for i in range(pos, len(self.images)):
+                        self.positions[self.images[i]] = i
+                    ops.append(('+', pos, name))
+                    placements.append((name, self.images[pos + 1] if pos + 1 < len(self.images) else None))
+                if ops:
+                    self._log(ops)
+                    self._index_inserts(folder, placements, defer_index)
+            elif folder == 'main':
+                try:
+                    images, _ = read_playlist(ORDER_PATH)
+                    present = set(images)
+                    ops, placements = [], []
+                    for name in names:
+                        if name not in present:
+                            pos = upcoming_position(-1, len(images))
+                            images.insert(pos, name)
+                            present.add(name)
+                            ops.append(('+', pos, name))
+                            placements.append((name, images[pos + 1] if pos + 1 < len(images) else None))
+                    if ops:
+                        append_playlist_log(ORDER_PATH, ops)
+                        self._index_inserts(folder, placements, defer_index)
+                except Exception as e:
+                    app.logger.error(f"Failed to add uploads to image_order: {e}")
+
+    def flush(self):
+        """Fold the log into a fresh snapshot."""
+        with self.lock, file_lock('playlist'):
+            self.sync()
+            self._persist()
+
+    def path(self, name):
+        return os.path.join(UPLOAD_ROOT, self.folder, name)
+
+playlist = Playlist()
+
+
+# --- Push channel for viewer state ---
+class EventBroker:
+    """Fans viewer events out to connected /events clients.
+
+    Each client owns a small bounded queue; a client that stops reading just
+    misses events instead of blocking the publisher.
+    """
+
+    def __init__(self, backlog=32):
+        self.backlog = backlog
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._seq = 0
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.backlog)
+        with self._lock:
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def publish(self, event, data, relay=True):
+        """Deliver to this worker's clients and (unless relayed in) to the other workers'."""
+        if relay:
+            worker_bus.send({'type': 'event', 'event': event, 'data': data})
+        with self._lock:
+            self._seq += 1
+            message = (self._seq, event, data)
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                pass
+
+broker = EventBroker()
+
+def format_sse(event, data, event_id=None):
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return '\n'.join(lines) + '\n\n'
+
+# --- Viewer processes ---
+class ViewerController:
+    """Owns the feh processes and signals them directly with os.kill.
+
+    The slideshow feh is adopted from /proc if something else started it,
+    otherwise launched here. Zooming is rendered server-side (see ZoomView),
+    so there is only ever the one viewer. Refreshes for the same symlink target within
+    `dedupe_window` seconds are dropped, and each transition's latency (from
+    update_viewer_state to the signal) is kept for /viewer-stats.
+    """
+
+    MAIN_TITLE = 'feh-frame'
+
+    def __init__(self, dedupe_window=0.5, history=200):
+        self._lock = threading.Lock()
+        self.dedupe_window = dedupe_window
+        self.main_pids = []
+        self.main_process = None
+        self.last_target = None
+        self.last_refresh = 0.0
+        self.latencies = deque(maxlen=history)
+        self.signals = 0
+        self.deduped = 0
+
+    @staticmethod
+    def _find_feh():
+        """PIDs of running feh processes, read from /proc."""
+        pids = []
+        try:
+            entries = os.listdir('/proc')
+        except OSError:
+            return pids
+        for entry in entries:
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/cmdline', 'rb') as f:
+                    argv = f.read().split(b'\0')
+            except OSError:
+                continue
+            if os.path.basename(argv[0]) == b'feh':
+                pids.append(int(entry))
+        return pids
+
+    def start(self):
+        """Adopt a running slideshow feh, or launch one on current.jpg."""
+        with self._lock:
+            self.main_pids = self._find_feh()
+            if self.main_pids:
+                app.logger.info(f"Adopted feh viewer(s): {self.main_pids}")
+                return
+            try:
+                # Outlives the server (adopted on restart), so keep it off our stdio
+                self.main_process = spawn_command([
+                    "feh", "--fullscreen", "--hide-pointer", "--auto-zoom",
+                    "--title", self.MAIN_TITLE, SYMLINK_PATH
+                ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                self.main_pids = [self.main_process.pid]
+            except OSError as e:
+                app.logger.error(f"Failed to launch feh: {e}")
+
+    def refresh(self, started=None):
+        """SIGUSR1 the slideshow feh so it reloads current.jpg."""
+        try:
+            target = os.readlink(SYMLINK_PATH)
+        except OSError:
+            target = None
+
+        with self._lock:
+            now = time.monotonic()
+            if target == self.last_target and now - self.last_refresh < self.dedupe_window:
+                self.deduped += 1
+                return
+            if self.main_process is not None and self.main_process.poll() is not None:
+                self.main_process = None  # reaped; fall through to rediscovery
+            if not self.main_pids:
+                self.main_pids = self._find_feh()
+
+            alive = []
+            for pid in self.main_pids:
+                try:
+                    os.kill(pid, signal.SIGUSR1)
+                    alive.append(pid)
+                except ProcessLookupError:
+                    pass
+                except OSError as e:
+                    app.logger.warning(f"Failed to signal feh ({pid}): {e}")
+            self.main_pids = alive
+            if not alive:
+                app.logger.warning("No feh viewer to refresh")
+                return
+
+            self.signals += 1
+            self.last_target, self.last_refresh = target, now
+            if started is not None:
+                self.latencies.append(time.perf_counter() - started)
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                'pids': list(self.main_pids),
+                'signals': self.signals,
+                'deduped': self.deduped,
+                'transition_ms': {
+                    'last': round(self.latencies[-1] * 1000, 2) if latencies else None,
+                    'p50': round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+                    'max': round(latencies[-1] * 1000, 2) if latencies else None,
+                },
+            }
+
+viewer = ViewerController()
+
+# --- Transition journal ---
+class StateJournal:
+    """One record of what the frame shows: folder, image, cursor, timer epoch and a sequence number.
+
+    Each transition rewrites it with a single write_atomic (one fsync and a
+    rename), and current.jpg is the only other file a transition touches.
+    Over the write budget, records are batched in memory (see WriteLedger).
+    Other workers notice a transition through the file's stamp.
+    """
+
+    EMPTY = {'seq': 0, 'folder': None, 'image': None, 'cursor': -1, 'epoch': None}
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.state = dict(self.EMPTY)
+        self.stamp = None
+
+    def _read(self):
+        stamp = disk_stamp(self.path)
+        if stamp is not None:
+            try:
+                with open(self.path) as f:
+                    self.state = dict(self.EMPTY, **json.load(f))
+            except (OSError, ValueError) as e:
+                app.logger.warning(f"Failed to read state journal: {e}")
+        self.stamp = stamp
+
+    def changed(self):
+        return disk_stamp(self.path) != self.stamp
+
+    def current(self):
+        """Latest record, re-read if another worker wrote one since."""
+        with self._lock:
+            if self.changed():
+                self._read()
+            return dict(self.state)
+
+    def record(self, folder, image, cursor, epoch):
+        with self._lock, file_lock('state'):
+            if self.changed():
+                self._read()  # keep seq monotonic across workers
+            self.state = {'seq': self.state['seq'] + 1, 'folder': folder, 'image': image,
+                          'cursor': cursor, 'epoch': epoch}
+            # Non-critical: recover() rebuilds a lost record, so it may be batched over budget
+            write_atomic(self.path, json.dumps(self.state), critical=False)
+            self.stamp = disk_stamp(self.path)
+            return dict(self.state)
+
+    def recover(self):
+        """Start-up check: rebuild the record if it is missing or names a vanished image.
+
+        Falls back to the legacy current_image.txt, then to whatever current.jpg
+        points at, and re-points current.jpg if it disagrees with the record.
+        """
+        if os.path.exists(self.path + '.tmp'):
+            os.remove(self.path + '.tmp')  # torn write; the previous record still stands
+
+        state = self.current()
+        folder, image = state['folder'], state['image']
+        if not (folder and image and os.path.exists(os.path.join(UPLOAD_ROOT, folder, image))):
+            folder = load_config().get('current_folder')
+            image = None
+            try:
+                with open(CURRENT_IMAGE_PATH) as f:
+                    image = f.read().strip() or None
+            except OSError:
+                pass
+            if not image:
+                try:
+                    target = os.path.realpath(SYMLINK_PATH)
+                    if os.path.dirname(os.path.dirname(target)) == UPLOAD_ROOT:
+                        folder, image = os.path.basename(os.path.dirname(target)), os.path.basename(target)
+                except OSError:
+                    pass
+            state = self.record(folder, image, -1, time.time())
+            app.logger.info(f"Rebuilt state journal: {state}")
+
+        # The legacy per-transition files are superseded by the journal
+        for legacy in (CURRENT_IMAGE_PATH, os.path.join(BASE_DIR, 'static', 'current_filename.txt')):
+            if os.path.exists(legacy):
+                os.remove(legacy)
+
+        if folder and image:
+            image_path = os.path.join(UPLOAD_ROOT, folder, image)
+            variant = display_cache.lookup(image_path)
+            if os.path.exists(image_path) and os.path.realpath(SYMLINK_PATH) != os.path.realpath(variant or image_path):
+                update_symlink(image_path, variant)
+        return state
+
+state_journal = StateJournal(STATE_PATH)
 
 def update_viewer_state(image_path, reset_delay=False):
-    retire_zoom_viewer()  # 👈 Cleanly retire zoom viewer before updating
+    global current_image_path
+    started = time.perf_counter()
+    zoom_view.reset()  # 👈 Drop any zoomed view before updating
+
+    current_image_path = image_path
+    name = os.path.basename(image_path)
+    playlist.seek(name)
+    if reset_delay:
+        slideshow.reset()
 
+    # 📓 One fsync per transition: the journal; the symlink is the only other write
     try:
-        with open(os.path.join(BASE_DIR, 'static', 'current_image.txt'), 'w') as f:
-            f.write(os.path.basename(image_path))
-            f.flush()
-            os.fsync(f.fileno())
+        state = state_journal.record(os.path.basename(os.path.dirname(image_path)), name,
+                                     playlist.index_of(name), slideshow.epoch)
     except Exception as e:
-        app.logger.error(f"Failed to update current_image.txt: {e}")
-
-    update_symlink(image_path)
-    refresh_viewer()
+        app.logger.error(f"Failed to record transition: {e}")
+        state = state_journal.state
+
+    # 🖼️ Point feh at the screen-sized variant when one is ready
+    variant = display_cache.lookup(image_path)
+    update_symlink(image_path, variant)
+    viewer.refresh(started)
+
+    if not variant:
+        display_cache.warm([image_path])
+    prefetcher.on_transition(image_path)
+    zoom_view.prepare(image_path)
+    deep_zoom.on_transition(image_path, [
+        playlist.path(upcoming) for upcoming in (playlist.peek(i) for i in range(1, DZI_AHEAD + 1)) if upcoming
+    ])
 
-    if reset_delay:
-        Path(os.path.join(BASE_DIR, 'delay_updated.flag')).touch()
+    broker.publish('image-changed', {
+        'filename': name,
+        'epoch': slideshow.epoch,
+        'seq': state['seq'],
+    })
 
 
 # Config
-def load_config():
-    try:
-        if os.path.exists(CONFIG_PATH):
-            with open(CONFIG_PATH, 'r') as f:
-                config = json.load(f)
+DEFAULT_CONFIG = {'delay': 5, 'current_folder': None}
+
+class ConfigStore:
+    """Parsed config.json kept in memory and handed out as immutable snapshots.
+
+    The file is re-parsed only when its mtime changes (checked at most once
+    per `check_interval` seconds); update() does the read-modify-write under
+    config_lock and the 'config' file lock, so concurrent workers never lose
+    each other's changes, and swaps in the new snapshot.
+    """
+
+    def __init__(self, path, check_interval=1.0):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = MappingProxyType(dict(DEFAULT_CONFIG))
+        self._mtime = None
+        self._checked = 0.0
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked < self.check_interval:
+            return
+        self._checked = now
+
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return
+
+        config = dict(DEFAULT_CONFIG)
+        if mtime is not None:
+            try:
+                with open(self.path, 'r') as f:
+                    config = json.load(f)
                 app.logger.info(f"Loaded config: {config}")
-                return config
-    except Exception as e:
-        app.logger.warning(f"Failed to load config: {e}")
-    return {'delay': 5, 'current_folder': None}
+            except Exception as e:
+                app.logger.warning(f"Failed to load config: {e}")
+                return  # keep the last good snapshot
+        self._snapshot = MappingProxyType(config)
+        self._mtime = mtime
+
+    def snapshot(self):
+        self._refresh()
+        return self._snapshot
+
+    def update(self, **changes):
+        """Apply changes atomically and persist them through save_config."""
+        with config_lock, file_lock('config'):
+            self._refresh(force=True)
+            config = dict(self._snapshot)
+            config.update(changes)
+            save_config(config)
+            self._snapshot = MappingProxyType(config)
+            try:
+                self._mtime = os.stat(self.path).st_mtime_ns
+            except OSError:
+                self._mtime = None
+            return self._snapshot
+
+config_store = ConfigStore(CONFIG_PATH)
+
+def load_config():
+    """Current config snapshot (read-only; use config_store.update() to change it)."""
+    return config_store.snapshot()
 
 
 def save_config(config):
@@ -104,124 +1034,1290 @@ def save_config(config):
         temp_path = os.path.join(BASE_DIR, 'config_temp.json')
         final_path = CONFIG_PATH  # already points to config.json
 
+        text = json.dumps(config)
         with open(temp_path, 'w') as f:
-            json.dump(config, f)
+            f.write(text)
             f.flush()
             os.fsync(f.fileno())
 
         os.replace(temp_path, final_path)
+        ledger.record(len(text.encode()), fsyncs=1, renames=1)
     except Exception as e:
         app.logger.error(f"Failed to save config atomically: {e}")
 
-def regenerate_image_order(blend_ratio=0.6, cutoff_days=90):
-    import time, random, math
+def scan_library(folder_path):
+    """(names, mtimes) of the images in a folder, from a single scandir pass."""
+    names, mtimes = [], []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                mtime = entry.stat().st_mtime
+            except OSError:
+                continue
+            names.append(entry.name)
+            mtimes.append(mtime)
+    return names, mtimes
+
+def shuffle_weights(mtimes, now, blend_ratio, cutoff_days):
+    """Per-photo sampling weights for the weighted shuffle.
+
+    Photos newer than `cutoff_days` share `blend_ratio` of the total weight,
+    each in proportion to exp(-age / cutoff); the archive shares the rest evenly.
+    """
+    cutoff_secs = cutoff_days * 86400
+    blend_ratio = min(max(blend_ratio, 0.01), 0.99)  # neither group may drop to zero weight
+    ages = [max(0.0, now - mtime) for mtime in mtimes]
+    recency = [math.exp(-age / cutoff_secs) if age <= cutoff_secs else 0.0 for age in ages]
+    n_archive = sum(1 for r in recency if not r)
+    recent_total = sum(recency)
+
+    # An empty group hands its share to the other one
+    recent_share = blend_ratio if n_archive else 1.0
+    archive_share = (1.0 - blend_ratio) if recent_total else 1.0
+    archive_weight = archive_share / n_archive if n_archive else 0.0
+    return [recent_share * r / recent_total if r else archive_weight for r in recency]
+
+def weighted_permutation(weights, rng=None):
+    """Indices ordered by Efraimidis–Spirakis keys: a weighted shuffle that keeps every item.
+
+    Each item gets key u ** (1 / w) for uniform u; sorting by descending key
+    is equivalent to sampling without replacement in proportion to weight.
+    log(u) / w gives the same order without underflow for tiny weights.
+    """
+    if np is not None:
+        rng = rng or np.random.default_rng()
+        keys = np.log(rng.random(len(weights))) / np.asarray(weights, dtype=np.float64)
+        return np.argsort(-keys, kind='stable').tolist()
+
+    rng = rng or random.Random()
+    keys = [math.log(1.0 - rng.random()) / w for w in weights]
+    return sorted(range(len(weights)), key=keys.__getitem__, reverse=True)
 
+def regenerate_image_order(blend_ratio=0.6, cutoff_days=90):
     folder_path = os.path.join(UPLOAD_ROOT, 'main')
     if not os.path.exists(folder_path):
         return
 
-    images = [
-        f for f in os.listdir(folder_path)
-        if not f.startswith('.') and os.path.isfile(os.path.join(folder_path, f))
-    ]
+    images, mtimes = scan_library(folder_path)
 
     config = load_config()
     weighted = config.get('weighted_shuffle', False)
 
     if not weighted:
         # 🌱 Non‑weighted: pure random shuffle
-        random.seed(time.time())
         random.shuffle(images)
         order = images
     else:
-        # Weighted shuffle logic (your existing code)
-        now = time.time()
-        cutoff_secs = cutoff_days * 86400
+        # ⚖️ Recent photos surface more often, but nothing is dropped from the cycle
+        weights = shuffle_weights(mtimes, time.time(), blend_ratio, cutoff_days)
+        order = [images[i] for i in weighted_permutation(weights)]
+
+    # Write safely (and refresh the resident copy if 'main' is playing)
+    playlist.replace('main', order, activate=False)
+    try:
+        library_index.set_order('main', 'random', order)
+    except Exception as e:
+        app.logger.warning(f"Failed to index image order: {e}")
+    return order
+
+# Thumbnail logic
+THUMB_SIZE = (300, 300)
+THUMB_QUALITY = 30
+# Encoder settings per format; AVIF's default speed is several times slower for no visible gain at these sizes
+THUMB_VARIANT_OPTIONS = {'webp': {'quality': 70, 'method': 4}, 'avif': {'quality': 55, 'speed': 8}}
+DEFAULT_THUMB_SIZES = (150, 300, 600)
+
+def thumb_sizes():
+    """Bounding-box widths of the WebP/AVIF variants ('thumb_sizes' in config)."""
+    sizes = load_config().get('thumb_sizes') or DEFAULT_THUMB_SIZES
+    return tuple(sorted(int(size) for size in sizes))
+
+@functools.lru_cache(maxsize=1)
+def thumb_formats():
+    """Modern formats this Pillow build can encode, best first."""
+    Image.init()
+    return tuple(fmt for fmt in ('avif', 'webp') if fmt.upper() in Image.SAVE)
+
+def thumb_variant_path(folder, filename, width, fmt):
+    return os.path.join(THUMB_ROOT, folder, str(width), f"{filename}.{fmt}")
+
+def thumbnail_paths(folder, filename):
+    """Every thumbnail file that may exist for one library image."""
+    paths = [os.path.join(THUMB_ROOT, folder, filename)]
+    for width in thumb_sizes():
+        paths += [thumb_variant_path(folder, filename, width, fmt) for fmt in thumb_formats()]
+    return paths
+
+def fit_within(size, box):
+    """Size that fits inside box while preserving aspect ratio (like Image.thumbnail)."""
+    width, height = size
+    scale = min(box[0] / width, box[1] / height, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def save_thumbnail(img, folder, filename, size=THUMB_SIZE, quality=THUMB_QUALITY):
+    """Write a thumbnail for an already decoded, upright image."""
+    thumb_folder = os.path.join(THUMB_ROOT, folder)
+    os.makedirs(thumb_folder, exist_ok=True)
+    thumb_path = os.path.join(thumb_folder, filename)
+
+    thumb = img.resize(fit_within(img.size, size), Image.BICUBIC, reducing_gap=2.0)
+    # Write beside the target and rename, so a reader never gets half a thumbnail
+    image_format = Image.registered_extensions().get(os.path.splitext(filename)[1].lower(), 'JPEG')
+    return save_image(thumb, thumb_path, image_format, quality=quality, optimize=True)
+
+def save_thumbnail_variants(img, folder, filename, variants=None):
+    """Write the given (width, format) variants, or every configured one, largest first."""
+    if img.mode not in ('RGB', 'RGBA', 'L'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    wanted = None if variants is None else set(variants)
+
+    paths = []
+    source = img
+    for width in reversed(thumb_sizes()):
+        if wanted is not None and not any(w <= width for w, _ in wanted):
+            break  # every wanted size is done
+        # Each size is scaled from the previous one, which is much cheaper than the original
+        source = source.resize(fit_within(source.size, (width, width)), Image.BICUBIC, reducing_gap=2.0)
+        for fmt in thumb_formats():
+            if wanted is not None and (width, fmt) not in wanted:
+                continue
+            path = thumb_variant_path(folder, filename, width, fmt)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            paths.append(save_image(source, path, fmt.upper(), **THUMB_VARIANT_OPTIONS[fmt]))
+    return paths
 
-        recent_images, archive_images = [], []
-        for img in images:
-            path = os.path.join(folder_path, img)
+def missing_variants(folder, filename):
+    """(width, format) variants that are absent or older than the source."""
+    try:
+        source_mtime = os.stat(os.path.join(UPLOAD_ROOT, folder, filename)).st_mtime
+    except OSError:
+        return []
+    missing = []
+    for width in thumb_sizes():
+        for fmt in thumb_formats():
             try:
-                mtime = os.path.getmtime(path)
-                age = now - mtime
-                if age <= cutoff_secs:
-                    recent_images.append(img)
-                else:
-                    archive_images.append(img)
-            except Exception:
-                archive_images.append(img)
+                if os.stat(thumb_variant_path(folder, filename, width, fmt)).st_mtime >= source_mtime:
+                    continue
+            except OSError:
+                pass
+            missing.append((width, fmt))
+    return missing
+
+def thumb_version(mtime, size):
+    """Short content token for a thumbnail URL, from the source's mtime/size and thumb settings."""
+    raw = f"{mtime:.6f}|{size}|{THUMB_SIZE}|{THUMB_QUALITY}|{thumb_sizes()}|{thumb_formats()}"
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into a single execution."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None}
+
+        if not leader:
+            call['done'].wait()
+            return call['result']
+
+        try:
+            call['result'] = fn(*args)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call['done'].set()
+        return call['result']
+
+thumbnail_flight = SingleFlight()
+
+def generate_thumbnail(folder, filename, size=THUMB_SIZE, quality=THUMB_QUALITY, legacy=True, variants=None):
+    """Build the legacy JPEG thumbnail and WebP/AVIF variants from one decode.
+
+    `variants` limits which (width, format) pairs are encoded (None means all);
+    request and upload paths ask for one or none and leave the rest to
+    thumb_variants. Returns the path of the legacy thumbnail, or of the last
+    variant written when `legacy` is False.
+    """
+    source_path = os.path.join(UPLOAD_ROOT, folder, filename)
+
+    try:
+        with Image.open(source_path) as img:
+            # ⚡ Let libjpeg decode at 1/2..1/8 scale when the outputs are small
+            widths = [width for width, _ in variants] if variants is not None else list(thumb_sizes())
+            largest = max(widths + ([size[0]] if legacy else []) or [size[0]])
+            with metrics.timer('frame_image_decode_seconds', pipeline='thumbnail'):
+                img.draft('RGB', (largest, largest))
+                img.load()
+            img = correct_orientation(img)  # ✅ EXIF-safe orientation correction
+            with metrics.timer('frame_image_encode_seconds', pipeline='thumbnail'):
+                thumb_path = save_thumbnail(img, folder, filename, size, quality) if legacy else None
+                if variants is None or variants:
+                    written = save_thumbnail_variants(img, folder, filename, variants)
+                    thumb_path = thumb_path or (written[-1] if written else None)
+            return thumb_path
+    except Exception as e:
+        app.logger.warning(f"Thumbnail error for {filename}: {e}")
+        return None
 
-        def weight(img):
+class VariantQueue:
+    """Encodes the WebP/AVIF thumbnail variants on a background thread.
+
+    Requests and uploads only write the thumbnail they need; the other sizes
+    and formats are filled in here, one image at a time, and by `app.py thumbs`.
+    Like the other rebuildable caches this pauses while over the write budget.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._thread = None
+
+    def enqueue(self, folder, filename):
+        if not thumb_formats():
+            return
+        key = (folder, filename)
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='thumb-variants', daemon=True)
+                self._thread.start()
+        self._queue.put(key)
+
+    def _worker(self):
+        while True:
+            folder, filename = self._queue.get()
             try:
-                mtime = os.path.getmtime(os.path.join(folder_path, img))
-                age = now - mtime
-                return math.exp(-age / cutoff_secs)
-            except Exception:
-                return 0.5
+                missing = missing_variants(folder, filename)
+                if missing and not ledger.over_budget():
+                    thumbnail_flight.do((folder, filename, 'variants'), functools.partial(
+                        generate_thumbnail, folder, filename, legacy=False, variants=missing))
+            except Exception as e:
+                app.logger.warning(f"Thumbnail variants failed for {filename}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard((folder, filename))
+
+thumb_variants = VariantQueue()
+
+def process_image(folder, filename):
+    """Decode an upload once and emit the display image and thumbnail from it.
+
+    The photo is rotated upright, cropped to 3:2 and written back in place.
+    Returns per-stage timings in seconds plus the metadata the library
+    index needs (final size and EXIF capture date, which the re-save drops).
+    """
+    path = os.path.join(UPLOAD_ROOT, folder, filename)
+    timings = {}
+
+    started = time.perf_counter()
+    with Image.open(path) as img:
+        taken_at = read_capture_date(img)
+        img.load()
+        timings['decode'] = time.perf_counter() - started
+
+        stage = time.perf_counter()
+        img = crop_to_aspect(correct_orientation(img))
+        timings['transform'] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        img.save(path)
+        ledger.record(os.path.getsize(path))
+        timings['encode_display'] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        save_thumbnail(img, folder, filename)  # WebP/AVIF variants follow via thumb_variants
+        timings['thumbnails'] = time.perf_counter() - stage
 
-        weighted_recent = [(random.random() * weight(img), img) for img in recent_images]
-        weighted_recent.sort(reverse=True)
-        recent_order = [img for _, img in weighted_recent]
+        stage = time.perf_counter()
+        display_cache.store(img, path)
+        timings['display_variant'] = time.perf_counter() - stage
 
-        archive_order = archive_images[:]
-        random.shuffle(archive_order)
+    timings['total'] = time.perf_counter() - started
+    return {'timings': timings, 'size': img.size, 'taken_at': taken_at}
 
-        n_recent = int(len(images) * blend_ratio)
-        n_archive = len(images) - n_recent
-        recent_order = recent_order[:n_recent]
-        archive_order = archive_order[:n_archive]
 
-        blended = []
-        while recent_order or archive_order:
-            if recent_order:
-                blended.append(recent_order.pop(0))
-            if archive_order:
-                blended.append(archive_order.pop(0))
+# --- Library metadata index ---
+LIBRARY_DB_PATH = os.path.join(BASE_DIR, 'library.db')
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
 
-        order = blended
+def is_image(filename):
+    return not filename.startswith('.') and os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS
 
-    # Write safely
-    order_path = os.path.join(BASE_DIR, 'image_order.txt')
+def read_capture_date(img):
+    """EXIF DateTimeOriginal (or DateTime) as 'YYYY-MM-DD HH:MM:SS', if present."""
     try:
-        with open(order_path, 'w') as f:
-            f.write('\n'.join(order))
-            f.flush()
-            os.fsync(f.fileno())
-    except Exception as e:
-        app.logger.error(f"Failed to write image_order.txt: {e}")
+        exif = img.getexif()
+        value = exif.get_ifd(0x8769).get(36867) or exif.get(306)
+        if value:
+            return str(value).strip().replace(':', '-', 2)
+    except Exception:
+        pass
+    return None
+
+class LibraryIndex:
+    """Persistent SQLite index of every photo under UPLOAD_ROOT.
+
+    Rows carry size, mtime, dimensions, EXIF capture date and thumbnail state
+    so every Browse sort is an indexed query instead of listdir + stat.
+    Custom and playlist orders live in `orders`; each folder has a version
+    that bumps on every change. reconcile() catches edits made outside the app.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS photos (
+            folder TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            size INTEGER,
+            mtime REAL,
+            width INTEGER,
+            height INTEGER,
+            taken_at TEXT,
+            thumb_state TEXT NOT NULL DEFAULT 'missing',
+            PRIMARY KEY (folder, filename)
+        );
+        CREATE INDEX IF NOT EXISTS photos_by_mtime ON photos (folder, mtime, filename);
+        CREATE TABLE IF NOT EXISTS orders (
+            folder TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            position INTEGER NOT NULL,
+            PRIMARY KEY (folder, kind, filename)
+        );
+        CREATE INDEX IF NOT EXISTS orders_by_position ON orders (folder, kind, position);
+        CREATE TABLE IF NOT EXISTS folders (
+            folder TEXT PRIMARY KEY,
+            dir_mtime INTEGER,
+            version INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            folder TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            op TEXT NOT NULL,
+            filename TEXT
+        );
+        CREATE INDEX IF NOT EXISTS changes_by_version ON changes (folder, version);
+    """
+
+    # Spacing between neighbouring order positions, so an insert fits between them
+    ORDER_GAP = 1024
+
+    # sort -> (keyset columns, "comes after" operator, ORDER BY)
+    KEYSET = {
+        'newest': ('mtime, filename', '<', 'mtime DESC, filename DESC'),
+        'oldest': ('mtime, filename', '>', 'mtime ASC, filename ASC'),
+        'az': ('filename', '>', 'filename ASC'),
+        'za': ('filename', '<', 'filename DESC'),
+    }
+
+    CHANGE_LOG_VERSIONS = 1000  # how far back delta requests can reach
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with self._lock:
+                if not self._schema_ready:
+                    conn.executescript(self.SCHEMA)
+                    self._schema_ready = True
+            self._local.conn = conn
+        return conn
+
+    @classmethod
+    def _bump(cls, conn, folder, changes=()):
+        """Advance folder's version and log (op, filename) changes against it."""
+        conn.execute("INSERT OR IGNORE INTO folders (folder) VALUES (?)", (folder,))
+        conn.execute("UPDATE folders SET version = version + 1 WHERE folder = ?", (folder,))
+        version = conn.execute("SELECT version FROM folders WHERE folder = ?", (folder,)).fetchone()[0]
+        conn.executemany("INSERT INTO changes (folder, version, op, filename) VALUES (?, ?, ?, ?)",
+                         ((folder, version, op, filename) for op, filename in changes))
+        conn.execute("DELETE FROM changes WHERE folder = ? AND version <= ?",
+                     (folder, version - cls.CHANGE_LOG_VERSIONS))
+        return version
+
+    @staticmethod
+    def _describe(folder, filename, st, taken_at=None, dims=None):
+        width, height = dims or (None, None)
+        if width is None or taken_at is None:
+            try:
+                with Image.open(os.path.join(UPLOAD_ROOT, folder, filename)) as img:  # header only
+                    width, height = img.size
+                    taken_at = taken_at or read_capture_date(img)
+            except Exception:
+                pass
 
-# Thumbnail logic
-def generate_thumbnail(folder, filename, size=(300, 300), quality=30):
-    source_path = os.path.join(UPLOAD_ROOT, folder, filename)
-    thumb_folder = os.path.join(THUMB_ROOT, folder)
-    os.makedirs(thumb_folder, exist_ok=True)
-    thumb_path = os.path.join(thumb_folder, filename)
+        try:
+            thumb_mtime = os.stat(os.path.join(THUMB_ROOT, folder, filename)).st_mtime
+            thumb_state = 'ready' if thumb_mtime >= st.st_mtime else 'stale'
+        except OSError:
+            thumb_state = 'missing'
+
+        return (folder, filename, st.st_size, st.st_mtime, width, height, taken_at, thumb_state)
+
+    def _write_rows(self, conn, rows):
+        conn.executemany("""
+            INSERT INTO photos (folder, filename, size, mtime, width, height, taken_at, thumb_state)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (folder, filename) DO UPDATE SET
+                size = excluded.size,
+                mtime = excluded.mtime,
+                width = excluded.width,
+                height = excluded.height,
+                taken_at = COALESCE(excluded.taken_at, photos.taken_at),
+                thumb_state = excluded.thumb_state
+        """, rows)
+
+    def upsert(self, folder, filename, taken_at=None, dims=None):
+        """Index (or refresh) one file; drops the row if the file is gone."""
+        try:
+            st = os.stat(os.path.join(UPLOAD_ROOT, folder, filename))
+        except FileNotFoundError:
+            self.remove(folder, filename)
+            return
+        row = self._describe(folder, filename, st, taken_at, dims)
+        conn = self._conn()
+        with conn:
+            known = conn.execute("SELECT 1 FROM photos WHERE folder = ? AND filename = ?",
+                                 (folder, filename)).fetchone()
+            self._write_rows(conn, [row])
+            self._bump(conn, folder, [('update' if known else 'add', filename)])
+
+    def remove(self, folder, filename):
+        conn = self._conn()
+        with conn:
+            if conn.execute("DELETE FROM photos WHERE folder = ? AND filename = ?",
+                            (folder, filename)).rowcount:
+                self._bump(conn, folder, [('remove', filename)])
+
+    def set_thumb_state(self, folder, filename, state):
+        self.set_thumb_states([(folder, filename)], state)
+
+    def set_thumb_states(self, items, state):
+        conn = self._conn()
+        with conn:
+            conn.executemany("UPDATE photos SET thumb_state = ? WHERE folder = ? AND filename = ?",
+                             ((state, folder, filename) for folder, filename in items))
+
+    def set_order(self, folder, kind, names):
+        """Replace a stored ordering ('custom' or 'random') for folder."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM orders WHERE folder = ? AND kind = ?", (folder, kind))
+            self._write_order(conn, folder, kind, names)
+            self._bump(conn, folder, [('reorder', kind)])
+
+    def _write_order(self, conn, folder, kind, names):
+        # Positions start at ORDER_GAP and leave ORDER_GAP - 1 free slots between neighbours
+        conn.executemany(
+            "INSERT OR REPLACE INTO orders (folder, kind, filename, position) VALUES (?, ?, ?, ?)",
+            ((folder, kind, name, (i + 1) * self.ORDER_GAP) for i, name in enumerate(dict.fromkeys(names))))
+
+    def edit_order(self, folder, kind, inserts=(), removes=()):
+        """Apply playlist edits to a stored ordering instead of rewriting it.
+
+        `inserts` are (name, before) pairs applied in turn: name goes just
+        ahead of `before`, or at the end if that is None or not in the order.
+        Each insert takes the midpoint of the gap ahead of `before`, so it
+        writes one row; the order is re-spaced only when that gap runs out.
+        """
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM orders WHERE folder = ? AND kind = ? AND filename = ?",
+                             ((folder, kind, name) for name in removes))
+            for name, before in inserts:
+                conn.execute("DELETE FROM orders WHERE folder = ? AND kind = ? AND filename = ?",
+                             (folder, kind, name))
+                position = self._position_before(conn, folder, kind, before) if before else None
+                if position is None:
+                    position = conn.execute("SELECT COALESCE(MAX(position), 0) + ? FROM orders WHERE folder = ? AND kind = ?",
+                                            (self.ORDER_GAP, folder, kind)).fetchone()[0]
+                conn.execute("INSERT INTO orders (folder, kind, filename, position) VALUES (?, ?, ?, ?)",
+                             (folder, kind, name, position))
+            self._bump(conn, folder, [('reorder', kind)])
+
+    def _position_before(self, conn, folder, kind, before):
+        """A free position just ahead of `before`, or None if it is not in the order."""
+        for _ in range(2):
+            row = conn.execute("SELECT position FROM orders WHERE folder = ? AND kind = ? AND filename = ?",
+                               (folder, kind, before)).fetchone()
+            if not row:
+                return None
+            upper = row[0]
+            lower = conn.execute("SELECT COALESCE(MAX(position), 0) FROM orders WHERE folder = ? AND kind = ? AND position < ?",
+                                 (folder, kind, upper)).fetchone()[0]
+            if upper - lower > 1:
+                return (lower + upper) // 2
+            # Gap used up: re-space the whole order once, then take the fresh gap
+            names = [r[0] for r in conn.execute(
+                "SELECT filename FROM orders WHERE folder = ? AND kind = ? ORDER BY position", (folder, kind))]
+            app.logger.info(f"Re-spacing {kind} order for {folder} ({len(names)} entries)")
+            self._write_order(conn, folder, kind, names)
+        return None
+
+    def version(self, folder):
+        row = self._conn().execute("SELECT version FROM folders WHERE folder = ?", (folder,)).fetchone()
+        return row[0] if row else 0
 
+    def ensure_folder(self, folder):
+        """Reconcile folder only if its directory mtime moved since the last scan."""
+        try:
+            dir_mtime = os.stat(os.path.join(UPLOAD_ROOT, folder)).st_mtime_ns
+        except FileNotFoundError:
+            return
+        row = self._conn().execute("SELECT dir_mtime FROM folders WHERE folder = ?", (folder,)).fetchone()
+        if row is None or row[0] != dir_mtime:
+            self.reconcile(folder)
+
+    def reconcile(self, folder=None):
+        """Bring the index in line with the files on disk; returns change counts."""
+        if folder:
+            folders = [folder]
+        else:
+            try:
+                folders = sorted(e.name for e in os.scandir(UPLOAD_ROOT)
+                                 if e.is_dir() and not e.name.startswith('.'))
+            except FileNotFoundError:
+                folders = []
+
+        totals = {'added': 0, 'updated': 0, 'removed': 0}
+        conn = self._conn()
+        for name in folders:
+            folder_path = os.path.join(UPLOAD_ROOT, name)
+            try:
+                dir_mtime = os.stat(folder_path).st_mtime_ns  # before the scan, so racing changes rescan
+                entries = list(os.scandir(folder_path))
+            except FileNotFoundError:
+                entries, dir_mtime = [], None
+
+            existing = {filename: (size, mtime) for filename, size, mtime in conn.execute(
+                "SELECT filename, size, mtime FROM photos WHERE folder = ?", (name,))}
+
+            rows, seen, changes = [], set(), []
+            for entry in entries:
+                if not is_image(entry.name) or not entry.is_file():
+                    continue
+                st = entry.stat()
+                seen.add(entry.name)
+                known = existing.get(entry.name)
+                if known != (st.st_size, st.st_mtime):
+                    totals['updated' if known else 'added'] += 1
+                    changes.append(('update' if known else 'add', entry.name))
+                    rows.append(self._describe(name, entry.name, st))
+            removed = [filename for filename in existing if filename not in seen]
+            totals['removed'] += len(removed)
+            changes += [('remove', filename) for filename in removed]
+
+            custom = None
+            custom_path = os.path.join(folder_path, 'custom_order.txt')
+            if os.path.exists(custom_path):
+                with open(custom_path) as f:
+                    custom = [line.strip() for line in f if line.strip()]
+                stored = [row[0] for row in conn.execute(
+                    "SELECT filename FROM orders WHERE folder = ? AND kind = 'custom' ORDER BY position", (name,))]
+                if custom == stored:
+                    custom = None
+                else:
+                    changes.append(('reorder', 'custom'))
+
+            with conn:
+                self._write_rows(conn, rows)
+                conn.executemany("DELETE FROM photos WHERE folder = ? AND filename = ?",
+                                 ((name, filename) for filename in removed))
+                if custom is not None:
+                    conn.execute("DELETE FROM orders WHERE folder = ? AND kind = 'custom'", (name,))
+                    self._write_order(conn, name, 'custom', custom)
+                conn.execute("INSERT OR IGNORE INTO folders (folder) VALUES (?)", (name,))
+                conn.execute("UPDATE folders SET dir_mtime = ? WHERE folder = ?", (dir_mtime, name))
+                if changes:
+                    self._bump(conn, name, changes)
+        return totals
+
+    def delta(self, folder, since):
+        """Adds/updates/removes since version `since`, or None if the log no longer reaches back."""
+        version = self.version(folder)
+        if since > version or since < version - self.CHANGE_LOG_VERSIONS:
+            return None
+
+        first, last, reordered = {}, {}, False
+        for op, filename in self._conn().execute(
+                "SELECT op, filename FROM changes WHERE folder = ? AND version > ? ORDER BY version, rowid",
+                (folder, since)):
+            if op == 'reorder':
+                reordered = True
+                continue
+            first.setdefault(filename, op)
+            last[filename] = op
+
+        added, removed, updated = [], [], []
+        for filename, op in last.items():
+            existed = first[filename] != 'add'
+            exists = op != 'remove'
+            if exists and not existed:
+                added.append(filename)
+            elif existed and not exists:
+                removed.append(filename)
+            elif exists:
+                updated.append(filename)
+        return {'version': version, 'since': since, 'added': added, 'removed': removed,
+                'updated': updated, 'reordered': reordered}
+
+    def versions(self, folder, names):
+        """{filename: thumb_version} for the given names."""
+        conn = self._conn()
+        result = {}
+        names = list(names)
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            rows = conn.execute(
+                f"SELECT filename, mtime, size FROM photos WHERE folder = ? AND filename IN ({', '.join('?' * len(chunk))})",
+                [folder] + chunk)
+            for filename, mtime, size in rows:
+                result[filename] = thumb_version(mtime, size)
+        return result
+
+    def count(self, folder):
+        return self._conn().execute("SELECT COUNT(*) FROM photos WHERE folder = ?", (folder,)).fetchone()[0]
+
+    _ORDERED_SQL = """
+        SELECT o.filename, o.position FROM orders o
+        JOIN photos p ON p.folder = o.folder AND p.filename = o.filename
+        WHERE o.folder = ? AND o.kind = ? AND o.position > ?
+        ORDER BY o.position LIMIT ?
+    """
+    _EXTRAS_SQL = """
+        SELECT filename FROM photos p
+        WHERE folder = ? AND filename > ? AND NOT EXISTS (
+            SELECT 1 FROM orders o
+            WHERE o.folder = p.folder AND o.kind = ? AND o.filename = p.filename)
+        ORDER BY filename LIMIT ?
+    """
+
+    def sorted_names(self, folder, sort):
+        """Filenames in folder ordered by sort, each an indexed query."""
+        names, _ = self.page(folder, sort, -1)
+        return names
+
+    def page(self, folder, sort, limit, after=None):
+        """One keyset page of the sorted listing (limit < 0 means everything).
+
+        Returns (names, cursor) where cursor is the sort key to pass as `after`
+        for the next page, or None when there is nothing more.
+        """
+        conn = self._conn()
+        if sort in ('custom', 'random'):
+            # Ordered entries first (phase 0), then anything not in the order by name (phase 1)
+            phase, key = after if after else (0, -1)
+            names = []
+            if phase == 0:
+                rows = conn.execute(self._ORDERED_SQL, (folder, sort, key, limit)).fetchall()
+                names = [row[0] for row in rows]
+                if limit >= 0 and len(rows) == limit:
+                    return names, [0, rows[-1][1]]
+                key = ''
+            remaining = limit - len(names) if limit >= 0 else -1
+            rows = conn.execute(self._EXTRAS_SQL, (folder, key, sort, remaining)).fetchall()
+            names += [row[0] for row in rows]
+            if remaining >= 0 and rows and len(rows) == remaining:
+                return names, [1, rows[-1][0]]
+            return names, None
+
+        columns, after_op, order_by = self.KEYSET.get(sort, self.KEYSET['az'])
+        sql = f"SELECT {columns} FROM photos WHERE folder = ?"
+        params = [folder]
+        if after:
+            sql += f" AND ({columns}) {after_op} ({', '.join('?' * len(after))})"
+            params += list(after)
+        sql += f" ORDER BY {order_by} LIMIT ?"
+        rows = conn.execute(sql, params + [limit]).fetchall()
+        names = [row[-1] for row in rows]
+        if limit >= 0 and len(rows) == limit:
+            return names, list(rows[-1])
+        return names, None
+
+    def rank(self, folder, sort, filename):
+        """Position of filename in the sorted listing, or -1 if it is not indexed."""
+        conn = self._conn()
+        if sort in ('custom', 'random'):
+            row = conn.execute("""
+                SELECT o.position FROM orders o
+                JOIN photos p ON p.folder = o.folder AND p.filename = o.filename
+                WHERE o.folder = ? AND o.kind = ? AND o.filename = ?
+            """, (folder, sort, filename)).fetchone()
+            ordered_before = """
+                SELECT COUNT(*) FROM orders o
+                JOIN photos p ON p.folder = o.folder AND p.filename = o.filename
+                WHERE o.folder = ? AND o.kind = ? AND o.position < ?
+            """
+            if row:
+                return conn.execute(ordered_before, (folder, sort, row[0])).fetchone()[0]
+            if not conn.execute("SELECT 1 FROM photos WHERE folder = ? AND filename = ?",
+                                (folder, filename)).fetchone():
+                return -1
+            ordered = conn.execute(ordered_before, (folder, sort, float('inf'))).fetchone()[0]
+            extras = conn.execute("""
+                SELECT COUNT(*) FROM photos p
+                WHERE folder = ? AND filename < ? AND NOT EXISTS (
+                    SELECT 1 FROM orders o
+                    WHERE o.folder = p.folder AND o.kind = ? AND o.filename = p.filename)
+            """, (folder, filename, sort)).fetchone()[0]
+            return ordered + extras
+
+        columns, after_op, _ = self.KEYSET.get(sort, self.KEYSET['az'])
+        key = conn.execute(f"SELECT {columns} FROM photos WHERE folder = ? AND filename = ?",
+                           (folder, filename)).fetchone()
+        if not key:
+            return -1
+        before_op = '>' if after_op == '<' else '<'
+        return conn.execute(
+            f"SELECT COUNT(*) FROM photos WHERE folder = ? AND ({columns}) {before_op} ({', '.join('?' * len(key))})",
+            [folder] + list(key)).fetchone()[0]
+
+library_index = LibraryIndex(LIBRARY_DB_PATH)
+
+
+# --- Screen-sized display variants for feh ---
+def screen_geometry():
+    """(width, height) of the frame's screen: config first, then the framebuffer."""
+    geometry = load_config().get('screen_geometry')
     try:
+        if geometry:
+            width, height = str(geometry).lower().split('x')
+            return int(width), int(height)
+        with open('/sys/class/graphics/fb0/virtual_size') as f:
+            width, height = f.read().strip().split(',')
+            return int(width), int(height)
+    except Exception:
+        return 1920, 1080
+
+class DisplayCache:
+    """Pre-scaled, upright JPEGs sized to the screen so feh never downscales.
+
+    Variants are keyed by source path, mtime and screen geometry, rendered in
+    the background ahead of use, and evicted least-recently-used once the
+    cache grows past its disk budget.
+    """
+
+    def __init__(self, root, budget_bytes=512 * 1024 * 1024):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def variant_path(self, source_path, geometry=None):
+        width, height = geometry or screen_geometry()
+        mtime_ns = os.stat(source_path).st_mtime_ns
+        key = hashlib.sha1(f"{source_path}|{mtime_ns}|{width}x{height}".encode()).hexdigest()
+        return os.path.join(self.root, key + '.jpg')
+
+    def lookup(self, source_path):
+        """Cached variant for source_path, or None if it has not been rendered."""
+        try:
+            path = self.variant_path(source_path)
+            if os.path.exists(path):
+                os.utime(path)  # mtime doubles as the LRU clock
+                return path
+        except Exception:
+            pass
+        return None
+
+    def store(self, img, source_path):
+        """Write a variant from an already decoded, upright image."""
+        geometry = screen_geometry()
+        path = self.variant_path(source_path, geometry)
+        if img.width <= geometry[0] and img.height <= geometry[1]:
+            return None  # already fits the screen; feh can show the original
+        if ledger.over_budget():
+            return None  # a cache feh can live without; skip it once the day's writes are spent
+
+        os.makedirs(self.root, exist_ok=True)
+        variant = img.resize(fit_within(img.size, geometry), Image.LANCZOS, reducing_gap=3.0)
+        if variant.mode != 'RGB':
+            variant = variant.convert('RGB')
+        save_image(variant, path, 'JPEG', quality=90)
+        self.evict()
+        return path
+
+    def render(self, source_path):
+        if self.lookup(source_path):
+            return
         with Image.open(source_path) as img:
-            # ✅ EXIF-safe orientation correction
+            img.draft('RGB', screen_geometry())
+            self.store(correct_orientation(img), source_path)
+
+    def warm(self, source_paths):
+        """Queue variants to be rendered in the background (not while over the write budget)."""
+        if ledger.over_budget():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='display-cache', daemon=True)
+                self._thread.start()
+            for source_path in source_paths:
+                if source_path and source_path not in self._pending:
+                    self._pending.add(source_path)
+                    self._queue.put(source_path)
+
+    def _worker(self):
+        while True:
+            source_path = self._queue.get()
             try:
-                if hasattr(img, '_getexif'):
-                    exif = img._getexif()
-                    if exif:
-                        orientation_tag = next(
-                            (tag for tag, name in ExifTags.TAGS.items() if name == 'Orientation'), None)
-                        orientation = exif.get(orientation_tag)
-                        if orientation == 3:
-                            img = img.rotate(180, expand=True)
-                        elif orientation == 6:
-                            img = img.rotate(270, expand=True)
-                        elif orientation == 8:
-                            img = img.rotate(90, expand=True)
+                if os.path.exists(source_path):
+                    self.render(source_path)
             except Exception as e:
-                app.logger.warning(f"EXIF correction failed for {filename}: {e}")
+                app.logger.warning(f"Display variant failed for {source_path}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(source_path)
 
-            img.thumbnail(size)  # Resize while preserving aspect ratio
-            img.save(thumb_path, quality=quality, optimize=True)
-        return thumb_path
-    except Exception as e:
-        app.logger.warning(f"Thumbnail error for {filename}: {e}")
-        return None
+    def evict(self):
+        try:
+            entries = [e for e in os.scandir(self.root) if e.is_file() and e.name.endswith('.jpg')]
+        except FileNotFoundError:
+            return
+        stats = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in entries]
+        total = sum(size for _, size, _ in stats)
+        if total <= self.budget_bytes:
+            return
+        for _, size, path in sorted(stats):
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+            if total <= self.budget_bytes:
+                break
+
+display_cache = DisplayCache(DISPLAY_CACHE_ROOT)
+
+
+# --- Server-side zoom and pan ---
+PYRAMID_ROOT = os.path.join(DISPLAY_CACHE_ROOT, 'pyramids')
+PYRAMID_KEEP = 8            # pyramids kept on disk, most recently used first
+ZOOM_FACTOR = 1.5           # magnification per zoom step
+MAX_ZOOM_LEVEL = 8
+ZOOM_ACTIVE_WINDOW = 300    # pre-build pyramids on transitions only this long after a zoom (seconds)
+ZOOM_VIEW_PATHS = (
+    os.path.join(DISPLAY_CACHE_ROOT, 'zoom-a.jpg'),
+    os.path.join(DISPLAY_CACHE_ROOT, 'zoom-b.jpg'),
+)
+
+class ImagePyramid:
+    """Upright copies of an image at 1/2, 1/4, ... scale, cached on disk.
+
+    Level 0 is the original; each level halves the previous one until it fits
+    in MIN_SIZE. Levels are written once per source version and decoded on
+    demand, so a zoom step only touches the level it needs. Only the last
+    decoded level is held in memory, which keeps a 48 MP original from
+    staying resident after the build.
+    """
+
+    MIN_SIZE = 256
+
+    def __init__(self, source_path):
+        self.source_path = source_path
+        mtime_ns = os.stat(source_path).st_mtime_ns
+        key = hashlib.sha1(f"{source_path}|{mtime_ns}".encode()).hexdigest()
+        self.dir = os.path.join(PYRAMID_ROOT, key)
+        self._lock = threading.Lock()
+        self._decoded = (None, None)  # (level, image) of the last level() call
+
+        try:
+            with open(os.path.join(self.dir, 'meta.json')) as f:
+                meta = json.load(f)
+            self.size, self.depth = tuple(meta['size']), meta['depth']
+            os.utime(self.dir)  # mtime doubles as the LRU clock
+        except (OSError, ValueError, KeyError):
+            self._build()
+
+    def _build(self):
+        with Image.open(self.source_path) as img:
+            img = correct_orientation(img)
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.load()
+        self.size = img.size
+
+        os.makedirs(self.dir, exist_ok=True)
+        depth = 1
+        while max(img.size) > self.MIN_SIZE:
+            img = img.reduce(2)  # the larger level is released here
+            save_image(img, os.path.join(self.dir, f"{depth}.jpg"), 'JPEG', quality=90)
+            depth += 1
+        self.depth = depth
+
+        # Written last: a pyramid without meta.json is rebuilt
+        write_atomic(os.path.join(self.dir, 'meta.json'), json.dumps({'size': self.size, 'depth': depth}))
+        self._prune()
+
+    @staticmethod
+    def _prune():
+        try:
+            dirs = sorted((e for e in os.scandir(PYRAMID_ROOT) if e.is_dir()),
+                          key=lambda e: e.stat().st_mtime, reverse=True)
+        except FileNotFoundError:
+            return
+        for entry in dirs[PYRAMID_KEEP:]:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+    def level(self, n):
+        """Decoded image for level n (level 0 is the upright original)."""
+        with self._lock:
+            level, img = self._decoded
+            if level == n:
+                return img
+            self._decoded = (None, None)  # let the previous level go before decoding the next
+            if n == 0:
+                with Image.open(self.source_path) as source:
+                    img = correct_orientation(source).convert('RGB')
+            else:
+                with Image.open(os.path.join(self.dir, f"{n}.jpg")) as cached:
+                    img = cached.convert('RGB')
+            self._decoded = (n, img)
+            return img
+
+class ZoomView:
+    """Zoomed/panned view of the image on screen, rendered here and shown via the symlink.
+
+    `level` 0 is the normal fitted display; each level magnifies by
+    ZOOM_FACTOR around `center` (fractions of the image width/height).
+    Views alternate between two files so feh always sees a new target.
+    The pyramid is built on first zoom; while someone has zoomed within
+    ZOOM_ACTIVE_WINDOW it is also built on each transition (prepare), so the
+    next slide's first step only decodes one level instead of the original.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pyramid = None
+        self.level = 0
+        self.center = (0.5, 0.5)
+        self._flip = 0
+        self._queue = queue.Queue()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self.last_zoom = 0.0
+
+    def prepare(self, image_path):
+        """Build the new slide's pyramid in the background if zooming is in use and the budget allows."""
+        if time.time() - self.last_zoom > ZOOM_ACTIVE_WINDOW or ledger.over_budget():
+            return
+        with self._start_lock:  # not self._lock, which a slow render may be holding
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='zoom-pyramid', daemon=True)
+                self._thread.start()
+        self._queue.put(image_path)
+
+    def _worker(self):
+        while True:
+            image_path = self._queue.get()
+            while not self._queue.empty():
+                image_path = self._queue.get_nowait()  # only the newest slide matters
+            try:
+                pyramid = tile_flight.do(('pyramid', image_path), ImagePyramid, image_path)
+            except Exception as e:
+                app.logger.warning(f"Zoom pyramid failed for {image_path}: {e}")
+                continue
+            with self._lock:
+                if pyramid is not None and image_path == current_image_path:
+                    self.pyramid = pyramid
+
+    def reset(self):
+        with self._lock:
+            self.level = 0
+            self.center = (0.5, 0.5)
+
+    def state(self):
+        with self._lock:
+            return {'level': self.level, 'center': list(self.center)}
+
+    def step(self, offset):
+        with self._lock:
+            level, center = self.level + offset, self.center
+        return self.show(level, center)
+
+    def show(self, level, center=None):
+        """Render and display the current image at level/center; returns the new state."""
+        image_path = current_image_path
+        if not image_path or not os.path.exists(image_path):
+            raise FileNotFoundError('No image on screen')
+
+        started = time.perf_counter()
+        with self._lock:
+            self.level = min(max(int(level), 0), MAX_ZOOM_LEVEL)
+            if center is not None:
+                self.center = tuple(min(max(float(c), 0.0), 1.0) for c in center)
+
+            if self.level:
+                self.last_zoom = time.time()
+            if self.level == 0:
+                # Back to the normal fitted display
+                update_symlink(image_path, display_cache.lookup(image_path))
+            else:
+                if self.pyramid is None or self.pyramid.source_path != image_path:
+                    # Joins a build prepare() already started rather than decoding twice
+                    self.pyramid = (tile_flight.do(('pyramid', image_path), ImagePyramid, image_path)
+                                    or ImagePyramid(image_path))
+                update_symlink(image_path, self._render())
+            state = {'level': self.level, 'center': list(self.center)}
+
+        viewer.refresh(started)
+        state['ms'] = round((time.perf_counter() - started) * 1000, 1)
+        return state
+
+    def _render(self):
+        width, height = self.pyramid.size
+        screen_w, screen_h = screen_geometry()
+        scale = min(screen_w / width, screen_h / height) * ZOOM_FACTOR ** self.level
+
+        # Smallest pyramid level that still has at least `scale` resolution
+        n = int(math.floor(math.log2(1 / scale))) if scale < 1 else 0
+        img = self.pyramid.level(min(max(n, 0), self.pyramid.depth - 1))
+        factor = img.width / width
+
+        # Visible region in original pixels, kept inside the image
+        region_w, region_h = min(width, screen_w / scale), min(height, screen_h / scale)
+        left = min(max(self.center[0] * width - region_w / 2, 0), width - region_w)
+        top = min(max(self.center[1] * height - region_h / 2, 0), height - region_h)
+        box = (left * factor, top * factor, (left + region_w) * factor, (top + region_h) * factor)
+        out_size = (max(1, round(region_w * scale)), max(1, round(region_h * scale)))
+
+        view = img.resize(out_size, Image.BILINEAR, box=box)
+        canvas = Image.new('RGB', (screen_w, screen_h))
+        canvas.paste(view, ((screen_w - out_size[0]) // 2, (screen_h - out_size[1]) // 2))
+
+        path = ZOOM_VIEW_PATHS[self._flip]
+        self._flip ^= 1
+        os.makedirs(DISPLAY_CACHE_ROOT, exist_ok=True)
+        return save_image(canvas, path, 'JPEG', quality=85)
+
+zoom_view = ZoomView()
+
+
+# --- Deep-zoom tiles for phones ---
+DZI_TILE_SIZE = 256
+DZI_AHEAD = 2               # upcoming slides to build pyramids for
+DZI_ACTIVE_WINDOW = 300     # only pre-build while a phone has asked recently (seconds)
+tile_flight = SingleFlight()
+
+def dzi_version(source_path):
+    stat = os.stat(source_path)
+    return hashlib.sha1(f"{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()[:12]
+
+class DeepZoom:
+    """DZI tiles (256 px, no overlap) cut on demand from ImagePyramid levels.
+
+    DZI level L is the image scaled by 2 ** (L - max_level), so pyramid level
+    max_level - L supplies it; levels smaller than the pyramid's last are
+    resized from it. Tiles are cached next to the pyramid, and recent
+    pyramids stay open (each holding its last decoded level) for the burst
+    of tile requests a zoom makes.
+    """
+
+    def __init__(self, keep=2):
+        self._lock = threading.Lock()
+        self._pyramids = OrderedDict()
+        self.keep = keep
+        self.last_request = 0.0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def pyramid(self, source_path):
+        with self._lock:
+            pyramid = self._pyramids.get(source_path)
+            if pyramid is not None:
+                self._pyramids.move_to_end(source_path)
+                return pyramid
+        pyramid = tile_flight.do(('pyramid', source_path), ImagePyramid, source_path)
+        with self._lock:
+            self._pyramids[source_path] = pyramid
+            while len(self._pyramids) > self.keep:
+                self._pyramids.popitem(last=False)
+        return pyramid
+
+    @staticmethod
+    def max_level(size):
+        return max(0, math.ceil(math.log2(max(size))))
+
+    def level_size(self, size, level):
+        shift = 2 ** (self.max_level(size) - level)
+        return math.ceil(size[0] / shift), math.ceil(size[1] / shift)
+
+    def level_image(self, pyramid, level):
+        n = self.max_level(pyramid.size) - level
+        if n < pyramid.depth:
+            return pyramid.level(n)
+        return pyramid.level(pyramid.depth - 1).resize(self.level_size(pyramid.size, level), Image.BILINEAR)
+
+    def descriptor(self, source_path):
+        width, height = self.pyramid(source_path).size
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" TileSize="{DZI_TILE_SIZE}" '
+            f'Overlap="0" Format="jpg"><Size Width="{width}" Height="{height}"/></Image>\n'
+        )
+
+    def tile(self, source_path, level, col, row):
+        """Path of the cached tile, cutting it first if needed; None if out of range."""
+        pyramid = self.pyramid(source_path)
+        if not 0 <= level <= self.max_level(pyramid.size):
+            return None
+        width, height = self.level_size(pyramid.size, level)
+        left, top = col * DZI_TILE_SIZE, row * DZI_TILE_SIZE
+        if col < 0 or row < 0 or left >= width or top >= height:
+            return None
+
+        path = os.path.join(pyramid.dir, 'tiles', str(level), f"{col}_{row}.jpg")
+        if os.path.exists(path):
+            return path
+        return tile_flight.do(path, self._cut, pyramid, level, (left, top), path)
+
+    def _cut(self, pyramid, level, origin, path):
+        img = self.level_image(pyramid, level)
+        left, top = origin
+        box = (left, top, min(left + DZI_TILE_SIZE, img.width), min(top + DZI_TILE_SIZE, img.height))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return save_image(img.crop(box), path, 'JPEG', quality=85)
+
+    def on_transition(self, image_path, upcoming):
+        """Build pyramids for the new slide and the next few, if a phone is watching."""
+        if time.time() - self.last_request > DZI_ACTIVE_WINDOW or ledger.over_budget():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='deep-zoom', daemon=True)
+                self._thread.start()
+        for source_path in [image_path] + upcoming:
+            self._queue.put(source_path)
+
+    def _worker(self):
+        while True:
+            source_path = self._queue.get()
+            try:
+                if os.path.exists(source_path):
+                    # Built to disk only; decoded levels are kept for images actually requested
+                    tile_flight.do(('pyramid', source_path), ImagePyramid, source_path)
+            except Exception as e:
+                app.logger.warning(f"Deep-zoom pyramid failed for {source_path}: {e}")
+
+deep_zoom = DeepZoom()
+
+
+# --- Read-ahead of upcoming slides ---
+class Prefetcher:
+    """Warms the next few playlist entries before the slideshow reaches them.
+
+    Upcoming files are pulled into the page cache with posix_fadvise(WILLNEED)
+    and queued for a display variant, up to `depth` entries and `budget_bytes`
+    per transition. Nothing is warmed while deletion.lock exists, and
+    invalidate() (on folder switches) drops any queued work.
+    """
+
+    def __init__(self, depth=3, budget_bytes=64 * 1024 * 1024):
+        self.depth = depth
+        self.budget_bytes = budget_bytes
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._warmed = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._warmed.clear()
+
+    def on_transition(self, image_path):
+        """Count a hit/miss for the image just shown and warm the ones after it."""
+        config = load_config()
+        depth = int(config.get('prefetch_depth', self.depth))
+        budget = int(config.get('prefetch_budget_mb', self.budget_bytes // (1024 * 1024))) * 1024 * 1024
+
+        with self._lock:
+            if self._warmed.pop(image_path, None):
+                self.hits += 1
+            else:
+                self.misses += 1
+            generation = self.generation
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name='prefetch', daemon=True)
+                self._thread.start()
+
+        with playlist.lock:
+            if not playlist.folder or not playlist.images:
+                return
+            upcoming = [playlist.path(playlist.peek(i)) for i in range(1, depth + 1)]
+        self._queue.put((generation, upcoming, budget))
+
+    def _worker(self):
+        lock_path = os.path.join(BASE_DIR, 'deletion.lock')
+        while True:
+            generation, upcoming, budget = self._queue.get()
+            if generation != self.generation or os.path.exists(lock_path):
+                continue
+
+            for path in upcoming:
+                if generation != self.generation:
+                    break
+                try:
+                    size = os.stat(path).st_size
+                    if size > budget:
+                        break
+                    budget -= size
+                    self._readahead(path)
+                except OSError:
+                    continue
+
+                display_cache.warm([path])
+                with self._lock:
+                    self._warmed[path] = True
+                    while len(self._warmed) > max(self.depth * 4, 16):
+                        self._warmed.popitem(last=False)
+
+    @staticmethod
+    def _readahead(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 3) if total else None,
+                'warmed': len(self._warmed),
+                'generation': self.generation,
+            }
+
+prefetcher = Prefetcher()
 
 @app.route("/clocks")
 def choose_clock():
@@ -229,13 +2325,214 @@ def choose_clock():
     return render_template("clocks.html", duration=duration)
 
 
+# --- Clock and billboard scripts ---
+CLOCKD_SOCKET = os.path.join(BASE_DIR, 'clockd.sock')
+CLOCKD_LOG_PATH = os.path.join(RUN_DIR, 'clockd.log')
+CLOCKD_PRELOAD = ('pygame', 'tkinter', 'PIL.Image', 'PIL.ImageTk', 'PIL.ImageDraw', 'PIL.ImageFont')
+
+def clock_env():
+    env = os.environ.copy()
+    env["DISPLAY"] = ":0"
+    env["XDG_RUNTIME_DIR"] = "/run/user/1000"
+    return env
+
+class ClockDaemon:
+    """Warm parent for clock/billboard scripts, serving requests on a unix socket.
+
+    Common modules are imported once here and each launch forks this process
+    and runs the script with runpy, so a clock switch skips interpreter start-up
+    and the heavy imports. The daemon stays single-threaded so forking is safe,
+    keeps child deadlines in one heap and reaps exited children with waitpid.
+    Requests and replies are one JSON object per line.
+    """
+
+    def __init__(self, path=CLOCKD_SOCKET):
+        self.path = path
+        self.sock = None
+        self.children = {}      # pid -> {'name', 'deadline'}
+        self.deadlines = []     # heap of (deadline, pid)
+
+    def preload(self):
+        for name in load_config().get('clockd_preload', CLOCKD_PRELOAD):
+            try:
+                __import__(name)
+            except Exception as e:
+                logging.info(f"clockd: not preloading {name}: {e}")
+
+    def serve_forever(self):
+        self.preload()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        os.chmod(self.path, 0o600)
+        self.sock.listen(8)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        logging.info(f"clockd listening on {self.path}")
+
+        try:
+            while True:
+                self._reap()
+                self._expire()
+                timeout = 1.0
+                if self.deadlines:
+                    # Never 0: settimeout(0) would make accept() non-blocking and raise BlockingIOError
+                    timeout = min(timeout, max(0.01, self.deadlines[0][0] - time.monotonic()))
+                self.sock.settimeout(timeout)
+                try:
+                    conn, _ = self.sock.accept()
+                except socket.timeout:
+                    continue
+                with conn:
+                    conn.settimeout(2)
+                    try:
+                        line = conn.makefile('rb').readline()
+                        reply = self._handle(json.loads(line))
+                    except Exception as e:
+                        reply = {'ok': False, 'error': str(e)}
+                    try:
+                        conn.sendall(json.dumps(reply).encode() + b'\n')
+                    except OSError:
+                        pass
+        finally:
+            self._stop()
+            self.sock.close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _handle(self, message):
+        cmd = message.get('cmd')
+        if cmd == 'launch':
+            script = message.get('script', '')
+            if script not in allowed_scripts:
+                return {'ok': False, 'error': f"Script not allowed: {script}"}
+            script_path = os.path.join(script_dir, script)
+            if not os.path.isfile(script_path):
+                return {'ok': False, 'error': f"Script not found: {script}"}
+            self._stop()
+            pid = self._fork(script_path, [str(arg) for arg in message.get('args', [])])
+            deadline = time.monotonic() + float(message.get('duration', 15 * 60))
+            self.children[pid] = {'name': script, 'deadline': deadline}
+            heapq.heappush(self.deadlines, (deadline, pid))
+            return {'ok': True, 'pid': pid}
+        if cmd == 'stop':
+            self._stop()
+            return {'ok': True}
+        if cmd == 'status':
+            now = time.monotonic()
+            return {'ok': True, 'running': [
+                {'pid': pid, 'name': child['name'], 'remaining': round(child['deadline'] - now, 1)}
+                for pid, child in self.children.items()
+            ]}
+        if cmd == 'ping':
+            return {'ok': True}
+        return {'ok': False, 'error': f"Unknown command: {cmd}"}
+
+    def _fork(self, script_path, args):
+        pid = os.fork()
+        if pid:
+            return pid
+
+        # Child: become the script, in its own process group so stop() catches its children too
+        code = 1
+        try:
+            self.sock.close()
+            os.setsid()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.environ.update(clock_env())
+            os.chdir(script_dir)
+            sys.path.insert(0, script_dir)
+            sys.argv = [script_path] + args
+            runpy.run_path(script_path, run_name='__main__')
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 0
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            os._exit(code)
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if not pid:
+                return
+            self.children.pop(pid, None)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, pid = heapq.heappop(self.deadlines)
+            child = self.children.get(pid)
+            if child and child['deadline'] <= now:
+                self._terminate(pid)
+        # Drop heap entries for children that are already gone
+        self.deadlines = [entry for entry in self.deadlines if entry[1] in self.children]
+        heapq.heapify(self.deadlines)
+
+    def _terminate(self, pid):
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        for _ in range(50):
+            try:
+                if os.waitpid(pid, os.WNOHANG)[0]:
+                    break
+            except ChildProcessError:
+                break
+            time.sleep(0.1)
+        else:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.pop(pid, None)
+        logging.info(f"clockd: stopped {pid}")
+
+    def _stop(self):
+        for pid in list(self.children):
+            self._terminate(pid)
+        self.deadlines = []
+
+def clockd_request(message, timeout=2.0):
+    """Send one request to clockd; returns its reply, or None if it is not running."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(CLOCKD_SOCKET)
+            sock.sendall(json.dumps(message).encode() + b'\n')
+            return json.loads(sock.makefile('rb').readline())
+    except (OSError, ValueError):
+        return None
+
+def ensure_clockd():
+    """Start clockd in the background unless one is already answering."""
+    if clockd_request({'cmd': 'ping'}, timeout=0.5):
+        return
+    try:
+        # Detached from our stdio, so a pipe reading the server still sees EOF when it exits
+        os.makedirs(RUN_DIR, exist_ok=True)
+        with open(CLOCKD_LOG_PATH, 'ab') as log:
+            spawn_command([sys.executable, os.path.abspath(__file__), 'clockd'], cwd=BASE_DIR, start_new_session=True,
+                          stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=log)
+    except OSError as e:
+        app.logger.warning(f"Failed to start clockd: {e}")
+
 def stop_active_clock():
     """Terminate any currently running clock or billboard safely."""
     global clock_process, active_clock_name, clock_timer
-    if clock_timer:
-        clock_timer.cancel()
+    if clock_timer is not None:
+        scheduler.cancel(clock_timer)
         clock_timer = None
 
+    clockd_request({'cmd': 'stop'}, timeout=6.0)
+
     if clock_process and clock_process.poll() is None:
         try:
             clock_process.terminate()
@@ -246,11 +2543,28 @@ def stop_active_clock():
     clock_process = None
     active_clock_name = None
 
+def start_clock(script_name, args, duration_minutes):
+    """Run an allowed script for duration_minutes, forked from clockd when it is up."""
+    global clock_process, active_clock_name, clock_timer
+    stop_active_clock()  # Kill any existing clock or billboard
+    active_clock_name = script_name.replace(".py", "")
+
+    reply = clockd_request({'cmd': 'launch', 'script': script_name, 'args': args,
+                            'duration': duration_minutes * 60})
+    if reply and reply.get('ok'):
+        return
+    if reply:
+        app.logger.warning(f"clockd refused {script_name}: {reply.get('error')}")
+    else:
+        ensure_clockd()  # it died since boot; respawn it so the next launch is warm again
+
+    # 🐢 Cold start: fresh interpreter, stopped by the shared scheduler
+    clock_process = spawn_command(['python3', os.path.join(script_dir, script_name)] + args, env=clock_env())
+    clock_timer = scheduler.call_later(duration_minutes * 60, stop_active_clock)
+
 
 @app.route('/launch/<script_name>')
 def launch(script_name):
-    global clock_process, active_clock_name, clock_timer
-
     if not script_name.endswith(".py"):
         script_name += ".py"
     if script_name not in allowed_scripts:
@@ -261,12 +2575,6 @@ def launch(script_name):
         return f"Script not found: {script_name}", 404
 
     try:
-        stop_active_clock()  # Kill any existing clock
-
-        env = os.environ.copy()
-        env["DISPLAY"] = ":0"
-        env["XDG_RUNTIME_DIR"] = "/run/user/1000"
-
         message = request.args.get('message', '')
         duration = request.args.get('duration', '15')
         try:
@@ -274,17 +2582,7 @@ def launch(script_name):
         except ValueError:
             duration_minutes = 15
 
-        args = ['python3', script_path]
-        if message:
-            args.append(message)
-
-        clock_process = subprocess.Popen(args, env=env)
-        active_clock_name = script_name.replace(".py", "")
-
-        # Schedule termination
-        clock_timer = threading.Timer(duration_minutes * 60, stop_active_clock)
-        clock_timer.start()
-
+        start_clock(script_name, [message] if message else [], duration_minutes)
         return redirect(url_for('choose_clock', duration=duration))
     except Exception as e:
         return f"Error launching {script_name}: {e}", 500
@@ -292,10 +2590,6 @@ def launch(script_name):
 
 @app.route('/launch_billboard')
 def launch_billboard():
-    global clock_process, active_clock_name, clock_timer
-
-    stop_active_clock()  # Kill any existing clock or billboard
-
     message = request.args.get('message', '')
     font = request.args.get('font', 'Copperplate')
     size = request.args.get('size', '36')
@@ -307,20 +2601,7 @@ def launch_billboard():
     except ValueError:
         duration_minutes = 30
 
-    script_path = os.path.join(script_dir, "Message2.py")
-    args = ['python3', script_path, message, font, size, color, background, duration]
-
-    env = os.environ.copy()
-    env["DISPLAY"] = ":0"
-    env["XDG_RUNTIME_DIR"] = "/run/user/1000"
-
-    clock_process = subprocess.Popen(args, env=env)
-    active_clock_name = "Message2"
-
-    # Schedule termination
-    clock_timer = threading.Timer(duration_minutes * 60, stop_active_clock)
-    clock_timer.start()
-
+    start_clock("Message2.py", [message, font, size, color, background, duration], duration_minutes)
     return redirect(url_for('choose_clock', duration=duration))
 
 @app.route('/billboard')
@@ -341,17 +2622,89 @@ def message():
 
 @app.route('/current-full')
 def current_full():
-    if not os.path.islink(SYMLINK_PATH):
+    # The symlink may point at a screen-sized variant; serve the original
+    if current_image_path:
+        full_path = current_image_path
+    elif os.path.islink(SYMLINK_PATH):
+        target_path = os.readlink(SYMLINK_PATH)
+        full_path = os.path.join(BASE_DIR, target_path) if not os.path.isabs(target_path) else target_path
+    else:
         return 'No current image', 404
 
-    target_path = os.readlink(SYMLINK_PATH)
-    full_path = os.path.join(BASE_DIR, target_path) if not os.path.isabs(target_path) else target_path
-
     if not os.path.exists(full_path):
         return 'Image not found', 404
 
     return send_file(full_path, mimetype='image/jpeg', cache_timeout=0)
 
+def dzi_source(folder, version, filename):
+    """Library path for a versioned DZI URL, or None if it is missing or stale."""
+    source_path = os.path.join(UPLOAD_ROOT, secure_filename(folder), secure_filename(filename))
+    try:
+        if dzi_version(source_path) == version:
+            return source_path
+    except OSError:
+        pass
+    return None
+
+@app.route('/current-dzi')
+def current_dzi():
+    """Deep-zoom descriptor URL for the image on screen (a light alternative to /current-full)."""
+    if not current_image_path or not os.path.exists(current_image_path):
+        return 'No current image', 404
+
+    deep_zoom.last_request = time.time()
+    folder = os.path.basename(os.path.dirname(current_image_path))
+    filename = os.path.basename(current_image_path)
+    response = jsonify({
+        'filename': filename,
+        'dzi': url_for('dzi_descriptor', folder=folder, version=dzi_version(current_image_path), filename=filename),
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/dzi/<folder>/<version>/<filename>.dzi')
+def dzi_descriptor(folder, version, filename):
+    source_path = dzi_source(folder, version, filename)
+    if not source_path:
+        return 'Not found', 404
+    deep_zoom.last_request = time.time()
+    response = Response(deep_zoom.descriptor(source_path), mimetype='application/xml')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/dzi/<folder>/<version>/<filename>_files/<int:level>/<int:col>_<int:row>.jpg')
+def dzi_tile(folder, version, filename, level, col, row):
+    source_path = dzi_source(folder, version, filename)
+    tile_path = deep_zoom.tile(source_path, level, col, row) if source_path else None
+    if not tile_path:
+        return 'Not found', 404
+    # The version is part of the URL, so a tile never changes once cut
+    response = send_file(tile_path, mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/prefetch-stats')
+def prefetch_stats():
+    return jsonify(prefetcher.stats())
+
+@app.route('/viewer-stats')
+def viewer_stats():
+    return jsonify(viewer.stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus text exposition of this worker's metrics."""
+    written = {(('source', source),): counts['bytes'] for source, counts in ledger.stats()['sources'].items()}
+    text = metrics.render(extra=[
+        ('frame_storage_written_bytes_total', 'counter', 'Bytes written to storage by endpoint or task.', written),
+    ])
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+@app.route('/write-stats')
+def write_stats():
+    """Bytes, fsyncs and renames written per endpoint/task, with today's budget use."""
+    return jsonify(ledger.stats())
+
 @app.route('/symlink-mtime')
 def symlink_mtime():
     try:
@@ -363,44 +2716,82 @@ def symlink_mtime():
 
 @app.route('/delay-mtime')
 def delay_mtime():
-    flag_path = os.path.join(BASE_DIR, 'delay_updated.flag')
-    try:
-        mtime = os.path.getmtime(flag_path)
-        return jsonify({'mtime': mtime})
-    except Exception as e:
-        app.logger.warning(f"Failed to read delay flag mtime: {e}")
-        return jsonify({'mtime': None}), 500
+    # Start of the current slide interval, kept in memory by the scheduler
+    return jsonify({'mtime': slideshow.epoch})
+
+@app.route('/api/state')
+def api_state():
+    """The transition journal: folder, image, cursor, epoch and seq of the current slide."""
+    state = state_journal.current()
+    state['epoch'] = slideshow.epoch  # a delay change restarts the timer without a transition
+    state['delay'] = load_config().get('delay', 1200)
+    response = jsonify(state)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/events')
+def events():
+    """Server-Sent Events stream of image/delay/folder/display changes.
+
+    Clients that cannot use it keep polling /symlink-mtime, /delay-mtime and /config.
+    The stream never ends, so it needs a threaded or async server: on a
+    single-threaded worker (gunicorn's default sync class) it answers 204,
+    which tells EventSource to stop reconnecting and Browse to poll instead.
+    """
+    if not request.environ.get('wsgi.multithread'):
+        return '', 204
+
+    config = load_config()
+    folder = config.get('current_folder')
+    if folder:
+        playlist.ensure(folder)
+    initial = {
+        'folder': folder,
+        'filename': playlist.current() if folder else None,
+        'delay': config.get('delay', 1200),
+        'epoch': slideshow.epoch,
+        'displayMuted': load_display_state().get('displayMuted', False),
+    }
+
+    def stream():
+        q = broker.subscribe()
+        try:
+            yield 'retry: 3000\n\n'
+            yield format_sse('state', initial)
+            while True:
+                try:
+                    event_id, event, data = q.get(timeout=15)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                yield format_sse(event, data, event_id)
+        finally:
+            broker.unsubscribe(q)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 # Symlink logic
-def update_symlink(image_path):
-    if os.path.exists(SYMLINK_PATH) or os.path.islink(SYMLINK_PATH):
-        os.remove(SYMLINK_PATH)
-    os.symlink(image_path, SYMLINK_PATH)
+def update_symlink(image_path, display_path=None):
+    """Point current.jpg at display_path (a cached variant) or the image itself.
 
-    # 🔧 Write real filename for frontend to read
-    with open(os.path.join(BASE_DIR, 'static', 'current_filename.txt'), 'w') as f:
-        f.write(os.path.basename(image_path))
+    The new link is made beside it and renamed over, so current.jpg never goes missing.
+    """
+    temp_link = SYMLINK_PATH + '.tmp'
+    if os.path.lexists(temp_link):
+        os.remove(temp_link)
+    os.symlink(display_path or image_path, temp_link)
+    os.replace(temp_link, SYMLINK_PATH)
 
 def get_next_image(folder):
-    order_path = os.path.join(BASE_DIR, 'image_order.txt')
-    current_path = os.path.join(BASE_DIR, 'static', 'current_filename.txt')
-
     try:
-        with open(order_path, 'r') as f:
-            images = f.read().strip().split()
-
-        with open(current_path, 'r') as f:
-            current = f.read().strip()
-
-        if current in images:
-            idx = images.index(current)
-            next_idx = (idx + 1) % len(images)
-            return os.path.join(UPLOAD_ROOT, folder, images[next_idx])
-        elif images:
-            return os.path.join(UPLOAD_ROOT, folder, images[0])
+        playlist.ensure(folder)
+        name = playlist.peek(1)
+        if name:
+            return os.path.join(UPLOAD_ROOT, folder, name)
     except Exception as e:
         app.logger.error(f"Failed to get next image: {e}")
-        return None
+    return None
 
 def correct_orientation(img):
     try:
@@ -465,26 +2856,47 @@ def index():
 def set_weighted_shuffle():
     data = request.get_json()
     enabled = data.get('enabled', False)
-    config = load_config()
-    config['weighted_shuffle'] = enabled
-    with config_lock:
-        save_config(config)
+    config_store.update(weighted_shuffle=enabled)
     return '', 204
 
+@app.route('/zoom', methods=['GET', 'POST'])
+def zoom():
+    """Zoom/pan the frame: `level` (0 = fit to screen) and `cx`/`cy` centre as 0..1 fractions."""
+    if request.method == 'GET':
+        return jsonify(zoom_view.state())
+
+    data = request.get_json(silent=True) or request.form
+    try:
+        level = int(data.get('level', zoom_view.level))
+        center = None
+        if 'cx' in data or 'cy' in data:
+            current = zoom_view.center
+            center = (float(data.get('cx', current[0])), float(data.get('cy', current[1])))
+    except (TypeError, ValueError):
+        return 'Invalid zoom level or centre', 400
+
+    try:
+        return jsonify(zoom_view.show(level, center))
+    except FileNotFoundError:
+        return 'No image on screen', 409
+    except Exception as e:
+        app.logger.error(f"Zoom failed: {e}")
+        return 'Zoom failed', 500
+
 @app.route('/zoom_in', methods=['POST'])
 def zoom_in():
-    if not send_zoom("in"):
-        launch_zoom_viewer()
-        time.sleep(0.3)
-        send_zoom("in")
+    try:
+        zoom_view.step(1)
+    except Exception as e:
+        app.logger.warning(f"Zoom in failed: {e}")
     return Response(status=204)
 
 @app.route('/zoom_out', methods=['POST'])
 def zoom_out():
-    if not send_zoom("out"):
-        launch_zoom_viewer()
-        time.sleep(0.3)
-        send_zoom("out")
+    try:
+        zoom_view.step(-1)
+    except Exception as e:
+        app.logger.warning(f"Zoom out failed: {e}")
     return Response(status=204)
 
 @app.route('/create-slideshow', methods=['POST'])
@@ -523,11 +2935,13 @@ def save_display_state(state):
     """Atomically save display mute state to disk."""
     try:
         temp_path = DISPLAY_STATE_PATH + ".tmp"
+        text = json.dumps(state)
         with open(temp_path, "w") as f:
-            json.dump(state, f)
+            f.write(text)
             f.flush()
             os.fsync(f.fileno())
         os.replace(temp_path, DISPLAY_STATE_PATH)
+        ledger.record(len(text.encode()), fsyncs=1, renames=1)
     except Exception as e:
         app.logger.error(f"Failed to save display state: {e}")
 
@@ -541,8 +2955,9 @@ def toggle_display():
           ["vcgencmd", "display_power", "1"]
 
     try:
-        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        run_command(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
         save_display_state({"displayMuted": display_muted})
+        broker.publish('display-muted', {"displayMuted": display_muted})
         return "", 204
     except subprocess.CalledProcessError:
         return "", 500
@@ -564,72 +2979,42 @@ def delete_image():
     try:
         with open(lock_path, 'w') as f:
             f.write('locked')
+        ledger.record(len('locked'))
     except Exception as e:
         app.logger.error(f"Failed to create deletion lock: {e}")
 
     if not filename or not folder:
         return 'Missing filename or folder', 400
 
-    # Read image list and current viewer position
-    order_path = os.path.join(BASE_DIR, 'image_order.txt')
-    try:
-        with open(order_path, 'r') as f:
-            images = f.read().strip().split()
-
-        current_target = os.readlink(SYMLINK_PATH) if os.path.islink(SYMLINK_PATH) else None
-        current_name = os.path.basename(current_target) if current_target else None
-        current_idx = images.index(current_name) if current_name in images else 0
-    except Exception as e:
-        app.logger.error(f"Failed to read image_order.txt or symlink: {e}")
-        images = []
-        current_idx = 0
+    playlist.ensure(folder)
+    was_current = playlist.current() == filename
 
-    # Delete image and thumbnail
+    # Delete image and thumbnails
     main_path = os.path.join(UPLOAD_ROOT, folder, filename)
-    thumb_path = os.path.join(THUMB_ROOT, folder, filename)
     try:
         if os.path.exists(main_path):
             os.remove(main_path)
-        if os.path.exists(thumb_path):
-            os.remove(thumb_path)
+        for thumb_path in thumbnail_paths(folder, filename):
+            if os.path.exists(thumb_path):
+                os.remove(thumb_path)
     except Exception as e:
         app.logger.error(f"Error deleting {filename}: {e}")
         return 'Error deleting file', 500
 
-    # Update image list
-    images = [img for img in images if img != filename]
     try:
-        with open(order_path, 'w') as f:
-            f.write('\n'.join(images))
-            f.flush()
-            os.fsync(f.fileno())
+        library_index.remove(folder, filename)
     except Exception as e:
-        app.logger.error(f"Failed to update image_order.txt: {e}")
-
-    # Choose next image based on current viewer position
-    if images:
-        next_idx = min(current_idx, len(images) - 1)
-        next_image_path = os.path.join(UPLOAD_ROOT, folder, images[next_idx])
-        update_viewer_state(next_image_path)
-
-        # 🔧 Sync current_filename.txt to match viewer
-        try:
-            with open(os.path.join(BASE_DIR, 'static', 'current_filename.txt'), 'w') as f:
-                f.write(os.path.basename(next_image_path))
-                f.flush()
-                os.fsync(f.fileno())
-        except Exception as e:
-            app.logger.error(f"Failed to update current_filename.txt: {e}")
+        app.logger.warning(f"Failed to drop {filename} from library index: {e}")
 
-        # 🕒 Touch delay_updated.flag to reset slideshow timer
-        flag_path = os.path.join(BASE_DIR, 'delay_updated.flag')
-        try:
-            from pathlib import Path
-            Path(flag_path).touch()
-        except Exception as e:
-            app.logger.error(f"Failed to touch delay_updated.flag: {e}")
+    # Update image list (the cursor stays on the same slot)
+    playlist.remove(filename)
 
-        refresh_viewer()
+    # Only move the viewer if the image on screen was the one deleted
+    next_name = playlist.current() if was_current else None
+    if next_name:
+        next_image_path = os.path.join(UPLOAD_ROOT, folder, next_name)
+        # 🕒 Reset the slideshow timer along with the transition
+        update_viewer_state(next_image_path, reset_delay=True)
 
     # ✅ Remove deletion lock
     if os.path.exists(lock_path):
@@ -658,6 +3043,7 @@ def save_custom_order():
         with open(order_path, 'w') as f:
             for filename in order:
                 f.write(filename + '\n')
+        library_index.set_order(folder, 'custom', order)
         return 'Order saved', 200
     except Exception as e:
         print(f"Error saving order: {e}")
@@ -671,20 +3057,12 @@ def browse():
     if not folder:
         return render_template('Browse.html', images=[], current=None, current_index=0)
 
-    order_path = os.path.join(BASE_DIR, 'image_order.txt')
-    try:
-        with open(order_path, 'r') as f:
-            images = [line.strip() for line in f if line.strip()]
-    except Exception as e:
-        app.logger.error(f"Failed to read image_order.txt: {e}")
-        images = []
-
-    try:
-        with open(os.path.join(BASE_DIR, 'static', 'current_filename.txt')) as f:
-            current_filename = f.read().strip()
-        current_index = images.index(current_filename)
-    except Exception as e:
-        app.logger.warning(f"Could not resolve current image: {e}")
+    playlist.ensure(folder)
+    images, cursor = playlist.snapshot()
+    if cursor >= 0:
+        current_filename = images[cursor]
+        current_index = cursor
+    else:
         current_filename = None
         current_index = 0
 
@@ -698,13 +3076,11 @@ def browse():
 def set_delay():
     try:
         minutes = int(request.form['delay'])
-        config = load_config()
-        config['delay'] = minutes * 60
 
-        # 🛡️ Protect config write + flag touch
-        with config_lock:
-            save_config(config)
-            Path(os.path.join(BASE_DIR, 'delay_updated.flag')).touch()
+        # 🛡️ Locked config write, then restart the countdown with the new delay
+        config = config_store.update(delay=minutes * 60)
+        slideshow.reset()
+        broker.publish('delay-changed', {'delay': config['delay'], 'epoch': slideshow.epoch})
 
         return '', 204
     except Exception as e:
@@ -715,21 +3091,17 @@ def set_delay():
 @app.route('/select_folder', methods=['POST'])
 def select_folder():
     folder = secure_filename(request.form['folder'])
-    config = load_config()
-    config['current_folder'] = folder
-
-    with config_lock:
-        save_config(config)
-        Path(os.path.join(BASE_DIR, 'delay_updated.flag')).touch()
+    config_store.update(current_folder=folder)
+    slideshow.reset()
+    prefetcher.invalidate()
+    broker.publish('folder-changed', {'folder': folder})
 
     folder_path = os.path.join(UPLOAD_ROOT, folder)
     images = []
 
     if folder == 'main':
-        order_path = os.path.join(BASE_DIR, 'image_order.txt')
-        if os.path.exists(order_path):
-            with open(order_path, 'r') as f:
-                images = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        playlist.ensure('main')
+        images, _ = playlist.snapshot()
     else:
         custom_order_path = os.path.join(folder_path, 'custom_order.txt')
         if os.path.exists(custom_order_path):
@@ -743,7 +3115,7 @@ def select_folder():
             images.sort()
 
         # ✅ Write slideshow_list.txt for non-main folders
-        create_slideshow_list(folder, images)
+        playlist.replace(folder, images)
 
     if images:
         first_image_path = os.path.join(folder_path, images[0])
@@ -751,6 +3123,176 @@ def select_folder():
 
     return '', 204
 
+# --- Upload processing ---
+def process_upload(folder, filename):
+    """Rotate/crop an uploaded photo in place and build its thumbnail.
+
+    Runs in a worker process, so it must only touch the filesystem.
+    Returns the pipeline's stage timings and image metadata, plus what it
+    wrote so the server's ledger can account for it.
+    """
+    before = ledger.totals()
+    try:
+        result = process_image(folder, filename)
+    except Exception as e:
+        app.logger.warning(f"Image processing failed for {filename}: {e}")
+
+        # Fall back to a thumbnail of the file as uploaded
+        generate_thumbnail(folder, filename, variants=())
+        result = {'timings': {}}
+
+    after = ledger.totals()
+    result['writes'] = {key: after[key] - before[key] for key in ('bytes', 'fsyncs', 'renames')}
+    return result
+
+
+class UploadJobs:
+    """Tracks upload batches processed by a process pool sized to the CPU count.
+
+    When other workers are running, each job's status is also mirrored to
+    RUN_DIR/jobs so /jobs/<id> answers whichever worker the poll lands on.
+    """
+
+    KEEP_SECONDS = 3600  # finished jobs stay queryable this long
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._pool = None
+        self._jobs = {}
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                # Not fork: a forked child could inherit ledger/metrics/logging locks held by other threads
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context('forkserver'))
+            return self._pool
+
+    def _prune(self):
+        cutoff = time.time() - self.KEEP_SECONDS
+        for job_id, job in list(self._jobs.items()):
+            if job['finished'] and job['finished'] < cutoff:
+                del self._jobs[job_id]
+                try:
+                    os.remove(self._shared_path(job_id))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _shared_path(job_id):
+        return os.path.join(RUN_DIR, 'jobs', f"{job_id}.json")
+
+    def _share(self, job_id):
+        if not worker_bus.peers():
+            return
+        try:
+            os.makedirs(os.path.dirname(self._shared_path(job_id)), exist_ok=True)
+            write_atomic(self._shared_path(job_id), json.dumps(self.status(job_id)))
+        except Exception as e:
+            app.logger.warning(f"Failed to share job {job_id} status: {e}")
+
+    def submit(self, folder, filenames):
+        """Queue already-saved files for processing; returns the job id."""
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'id': job_id,
+            'folder': folder,
+            'created': time.time(),
+            'finished': None,
+            'files': {name: {'status': 'queued'} for name in filenames},
+            'futures': {},
+        }
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+        self._share(job_id)
+        if not filenames:
+            job['finished'] = time.time()
+            return job_id
+
+        pool = self._get_pool()
+        for name in filenames:
+            future = pool.submit(process_upload, folder, name)
+            job['futures'][name] = future
+            future.add_done_callback(lambda f, name=name: self._file_done(job_id, name, f))
+        return job_id
+
+    def _file_done(self, job_id, name, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return
+
+        error = future.exception()
+        entry = job['files'][name]
+        result = {}
+        if error is None:
+            result = future.result()
+            entry['status'] = 'done'
+            entry['timings'] = {stage: round(secs, 4) for stage, secs in result['timings'].items()}
+            timings = result['timings']
+            if 'decode' in timings:
+                metrics.observe('frame_image_decode_seconds', timings['decode'], pipeline='upload')
+                metrics.observe('frame_image_encode_seconds',
+                                timings['encode_display'] + timings['thumbnails'] + timings['display_variant'],
+                                pipeline='upload')
+            writes = result.get('writes', {})
+            ledger.record(writes.get('bytes', 0), writes.get('fsyncs', 0), writes.get('renames', 0), source='upload-pool')
+        else:
+            entry['status'] = 'failed'
+            entry['error'] = str(error)
+            app.logger.warning(f"Upload processing failed for {name}: {error}")
+
+        try:
+            library_index.upsert(job['folder'], name, taken_at=result.get('taken_at'), dims=result.get('size'))
+        except Exception as e:
+            app.logger.warning(f"Failed to index upload {name}: {e}")
+
+        # ➕ Finished photos join the upcoming slides right away; the indexed order is written once per job
+        if error is None:
+            playlist.insert_upcoming(job['folder'], [name], defer_index=True)
+            thumb_variants.enqueue(job['folder'], name)
+        if all(f['status'] in ('done', 'failed') for f in job['files'].values()):
+            job['finished'] = time.time()
+            playlist.flush_index()
+
+        self._share(job_id)
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            # Possibly submitted to another worker
+            try:
+                with open(self._shared_path(secure_filename(job_id))) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                return None
+
+        files = {}
+        for name, entry in job['files'].items():
+            entry = dict(entry)
+            future = job['futures'].get(name)
+            if entry['status'] == 'queued' and future is not None and future.running():
+                entry['status'] = 'processing'
+            files[name] = entry
+
+        done = sum(1 for f in files.values() if f['status'] == 'done')
+        failed = sum(1 for f in files.values() if f['status'] == 'failed')
+        return {
+            'id': job['id'],
+            'folder': job['folder'],
+            'total': len(files),
+            'done': done,
+            'failed': failed,
+            'finished': job['finished'] is not None,
+            'files': files,
+        }
+
+upload_jobs = UploadJobs()
+
+
 @app.route('/upload', methods=['POST'])
 def upload():
     folder = secure_filename(request.form['folder'])
@@ -765,49 +3307,27 @@ def upload():
             counter += 1
         return filename
 
+    # 💾 Persist the raw files only; rotation, crop and thumbnails run in the pool
+    saved = []
     for file in request.files.getlist('photos'):
         filename = secure_filename(file.filename)
         filename = get_unique_filename(folder_path, filename)
-        path = os.path.join(folder_path, filename)
-        file.save(path)
-
-        # 🧠 Apply EXIF-safe orientation correction + 3:2 aspect crop
-        try:
-            with Image.open(path) as img:
-                if hasattr(img, '_getexif'):
-                    exif = img._getexif()
-                    if exif:
-                        orientation_tag = next(
-                            (tag for tag, name in ExifTags.TAGS.items() if name == 'Orientation'), None)
-                        orientation = exif.get(orientation_tag)
-                        if orientation == 3:
-                            img = img.rotate(180, expand=True)
-                        elif orientation == 6:
-                            img = img.rotate(270, expand=True)
-                        elif orientation == 8:
-                            img = img.rotate(90, expand=True)
-
-                width, height = img.size
-                desired_ratio = 3 / 2
-                current_ratio = width / height
-
-                if current_ratio > desired_ratio:
-                    new_width = int(height * desired_ratio)
-                    left = (width - new_width) // 2
-                    box = (left, 0, left + new_width, height)
-                else:
-                    new_height = int(width / desired_ratio)
-                    top = (height - new_height) // 2
-                    box = (0, top, width, top + new_height)
+        file.save(os.path.join(folder_path, filename))
+        ledger.record(os.path.getsize(os.path.join(folder_path, filename)))
+        saved.append(filename)
 
-                img = img.crop(box)
-                img.save(path)
-        except Exception as e:
-            app.logger.warning(f"Image processing failed for {filename}: {e}")
+    job_id = upload_jobs.submit(folder, saved)
 
-        generate_thumbnail(folder, filename)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'job': job_id, 'status': url_for('job_status', job_id=job_id)}), 202
+    return redirect(url_for('index', job=job_id))
 
-    return redirect(url_for('index'))
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    status = upload_jobs.status(job_id)
+    if status is None:
+        return 'Job not found', 404
+    return jsonify(status)
 
 
 @app.route('/next', methods=['POST'])
@@ -836,54 +3356,114 @@ def previous_image():
     if not folder:
         return jsonify({'image': None})
 
-    # ✅ Use correct playlist based on folder
-    playlist_name = 'image_order.txt' if folder == 'main' else 'slideshow_list.txt'
-    order_path = os.path.join(BASE_DIR, playlist_name)
-
-    try:
-        with open(order_path, 'r') as f:
-            images = [line.strip() for line in f if line.strip()]
-    except Exception as e:
-        app.logger.error(f"Error reading {playlist_name}: {e}")
-        return jsonify({'image': None})
-
-    if not images:
+    # ✅ Resident playlist for the current folder
+    playlist.ensure(folder)
+    name = playlist.step(-1)
+    if not name:
         return jsonify({'image': None})
 
-    try:
-        with open(os.path.join(BASE_DIR, 'static', 'current_image.txt')) as f:
-            current_name = f.read().strip()
-        idx = images.index(current_name)
-        prev_idx = (idx - 1) % len(images)
-    except Exception as e:
-        app.logger.warning(f"Could not find current image in list: {e}")
-        prev_idx = 0
+    image_path = os.path.join(UPLOAD_ROOT, folder, name)
+    # ✅ Reset slideshow timer
+    update_viewer_state(image_path, reset_delay=True)
 
-    image_path = os.path.join(UPLOAD_ROOT, folder, images[prev_idx])
-    update_viewer_state(image_path, reset_delay=False)
+    return jsonify({'image': url_for('static', filename='current.jpg')})
 
-    # ✅ Touch delay_updated.flag to reset slideshow timer
-    try:
-        Path(os.path.join(BASE_DIR, 'delay_updated.flag')).touch()
-    except Exception as e:
-        app.logger.error(f"Failed to touch delay_updated.flag: {e}")
 
-    return jsonify({'image': url_for('static', filename='current.jpg')})
 
+def pick_thumbnail(folder, filename, width):
+    """(directory, file name, mimetype, (width, format)) of the best thumbnail for this request.
 
+    With `w` set, the smallest configured size covering it is served as AVIF
+    or WebP when the Accept header names that format; otherwise the legacy JPEG.
+    """
+    if width:
+        sizes = thumb_sizes()
+        chosen = next((size for size in sizes if size >= width), sizes[-1])
+        for fmt in thumb_formats():
+            # Only formats listed by name: '*/*' or 'image/*' says nothing about AVIF support
+            if any(value == f"image/{fmt}" and quality > 0 for value, quality in request.accept_mimetypes):
+                path = thumb_variant_path(folder, filename, chosen, fmt)
+                return os.path.dirname(path), os.path.basename(path), f"image/{fmt}", (chosen, fmt)
+    return os.path.join(THUMB_ROOT, folder), filename, None, None
 
 @app.route('/thumbs/<folder>/<filename>')
 def serve_thumbnail(folder, filename):
-    thumb_dir = os.path.join(THUMB_ROOT, folder)
-    thumb_path = os.path.join(thumb_dir, filename)
+    """Thumbnail for a library image, generated on first request.
+
+    URLs carry `v=<thumb_version>`; when it matches the source the response is
+    cacheable forever, otherwise clients revalidate with the ETag. `w` asks
+    for a width, and the format follows the Accept header.
+    """
+    thumb_dir, thumb_name, mimetype, variant = pick_thumbnail(folder, filename, request.args.get('w', type=int))
+    thumb_path = os.path.join(thumb_dir, thumb_name)
+
+    try:
+        source = os.stat(os.path.join(UPLOAD_ROOT, folder, filename))
+    except OSError:
+        source = None
+    version = thumb_version(source.st_mtime, source.st_size) if source else None
+    etag = f"{version}-{thumb_name if mimetype else 'jpeg'}" if version else None
+
+    if etag and etag in request.if_none_match:
+        metrics.inc('frame_thumbnail_requests_total', result='not_modified')
+        response = not_modified(etag)
+    else:
+        try:
+            fresh = source is None or os.stat(thumb_path).st_mtime >= source.st_mtime
+        except OSError:
+            fresh = False
+        metrics.inc('frame_thumbnail_requests_total', result='hit' if fresh else 'miss')
+        if not fresh:
+            # One generation per thumbnail, however many requests race for it; only
+            # the file asked for is encoded here, the other variants in the background
+            if variant:
+                thumbnail_flight.do((folder, filename) + variant, functools.partial(
+                    generate_thumbnail, folder, filename, legacy=False, variants=[variant]))
+            elif thumbnail_flight.do((folder, filename), functools.partial(
+                    generate_thumbnail, folder, filename, variants=())):
+                library_index.set_thumb_state(folder, filename, 'ready')
+            thumb_variants.enqueue(folder, filename)
+
+        response = send_from_directory(thumb_dir, thumb_name, mimetype=mimetype)
+        if etag:
+            response.set_etag(etag)
+
+    response.vary.add('Accept')
+    if version and request.args.get('v') == version:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
 
-    if not os.path.exists(thumb_path):
-        result = generate_thumbnail(folder, filename)
-        
-    return send_from_directory(thumb_dir, filename)
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode()))
+
+def conditional_json(payload, etag):
+    """JSON response carrying an ETag; clients must revalidate before reuse."""
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/api/thumbnails')
 def api_thumbnails():
+    """Sorted filenames for the current folder.
+
+    Optional `limit`/`after` return keyset pages (`next` is the cursor for the
+    following page); `since=<version>` returns only adds/removes since then.
+    Responses carry an ETag derived from the folder version and honour
+    If-None-Match with 304.
+    """
     config = load_config()
     folder = config.get('current_folder')
     folder_path = os.path.join(UPLOAD_ROOT, folder) if folder else None
@@ -892,68 +3472,217 @@ def api_thumbnails():
         return jsonify({"folder": folder, "images": [], "total": 0})
 
     sort = request.args.get('sort', 'newest')
-    ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png'}
-    def is_image(filename):
-        return os.path.splitext(filename)[1].lower() in ALLOWED_EXTENSIONS
-
-    images = [f for f in os.listdir(folder_path)
-              if not f.startswith('.') and is_image(f)]
-
-    # ✅ Apply custom order if requested
-    custom_order_path = os.path.join(folder_path, 'custom_order.txt')
-    if sort == 'custom' and os.path.exists(custom_order_path):
-        with open(custom_order_path, 'r') as f:
-            custom_order = [line.strip() for line in f if line.strip()]
-        ordered = [f for f in custom_order if f in images]
-        extras = [f for f in images if f not in ordered]
-        images = ordered + sorted(extras)
-
-    # ✅ Apply random (playlist) order if requested
-    elif sort == 'random':
-        order_path = os.path.join(BASE_DIR, 'image_order.txt')
-        if os.path.exists(order_path):
-            with open(order_path, 'r') as f:
-                playlist_order = [line.strip() for line in f if line.strip()]
-            images = [f for f in playlist_order if f in images]
-            extras = [f for f in os.listdir(folder_path)
-                      if not f.startswith('.') and is_image(f) and f not in images]
-            images += sorted(extras)
-
-    elif sort == 'newest':
-        images.sort(key=lambda f: os.path.getmtime(os.path.join(folder_path, f)), reverse=True)
-    elif sort == 'oldest':
-        images.sort(key=lambda f: os.path.getmtime(os.path.join(folder_path, f)))
-    elif sort == 'az':
-        images.sort()
-    elif sort == 'za':
-        images.sort(reverse=True)
-
-    total = len(images)
-
-    # Try to read the current filename we write elsewhere; don't let errors break the endpoint
-    current_filename = None
+    limit = request.args.get('limit', type=int)
+    since = request.args.get('since', type=int)
+    cursor = request.args.get('after')
     try:
-        with open(os.path.join(BASE_DIR, 'static', 'current_filename.txt')) as f:
-            current_filename = f.read().strip() or None
+        after = decode_cursor(cursor) if cursor else None
     except Exception:
-        current_filename = None
+        return 'Invalid cursor', 400
+
+    # 🗂️ Sorted straight out of the library index (rescanned only if the folder changed)
+    library_index.ensure_folder(folder)
+    version = library_index.version(folder)
+
+    if since is not None:
+        etag = f"{folder}-{version}-since-{since}"
+        if etag in request.if_none_match:
+            return not_modified(etag)
+        delta = library_index.delta(folder, since)
+        if delta is None:
+            return jsonify({"folder": folder, "version": version, "reset": True})
+        return conditional_json(dict(delta, folder=folder, reset=False), etag)
+
+    # Only the first page carries the current image, so later pages stay cacheable
+    current_filename = None
+    if not after:
+        playlist.ensure(folder)
+        current_filename = playlist.current()
 
-    # Compute the index of the current file in the images list (or -1 if not present)
-    current_index = -1
-    if current_filename and current_filename in images:
-        try:
-            current_index = images.index(current_filename)
-        except Exception:
-            current_index = -1
+    etag = hashlib.sha1(f"{folder}|{version}|{sort}|{limit}|{cursor}|{current_filename}".encode()).hexdigest()
+    if etag in request.if_none_match:
+        return not_modified(etag)
 
-    # Return all images (no pagination) + current filename/index for client optimization
-    return jsonify({
+    images, next_key = library_index.page(folder, sort, limit if limit and limit > 0 else -1, after)
+    total = library_index.count(folder)
+
+    # Index of the current file in the full sorted listing (or -1 if not present)
+    current_index = -1
+    if current_filename:
+        current_index = library_index.rank(folder, sort, current_filename)
+
+    # 🔖 Content-versioned thumbnail URLs, cacheable as immutable
+    versions = library_index.versions(folder, images)
+    thumbs = [url_for('serve_thumbnail', folder=folder, filename=name, v=versions.get(name)) for name in images]
+
+    # 📐 srcset per image so high-DPI phones pick a sharper size
+    srcsets = []
+    if thumb_formats():
+        for name in images:
+            srcsets.append(', '.join(
+                f"{url_for('serve_thumbnail', folder=folder, filename=name, v=versions.get(name), w=width)} {width}w"
+                for width in thumb_sizes()))
+
+    return conditional_json({
         "folder": folder,
+        "version": version,
         "images": images,
+        "thumbs": thumbs,
+        "srcsets": srcsets,
+        "sprite": url_for('api_sprites', sort=sort, limit=limit, after=cursor, v=version),
         "total": total,
         "current": current_filename or "",
-        "current_index": current_index
-    })
+        "current_index": current_index,
+        "next": encode_cursor(next_key) if next_key else None
+    }, etag)
+
+# --- Sprite sheets for the Browse grid ---
+# One page of the grid becomes a few JPEG sheets plus an offset map, so Browse
+# loads in a handful of requests instead of one per thumbnail. Sheets only use
+# thumbnails that already exist (the rest load individually, which generates
+# them) and are named after the page's names and thumbnail versions, so a
+# reshuffle or an edit elsewhere in the folder leaves them valid.
+SPRITE_ROOT = os.path.join(THUMB_ROOT, '.sprites')
+SPRITE_CELL = 160
+SPRITE_COLUMNS = 10
+SPRITE_TILES = 100      # tiles per sheet, keeps decoded sheets small on phones
+SPRITE_QUALITY = 60
+SPRITE_KEEP = 64        # page maps kept on disk, most recently used first
+
+def sprite_tile(folder, filename):
+    """Square, centre-cropped SPRITE_CELL tile from the legacy thumbnail."""
+    thumb_path = os.path.join(THUMB_ROOT, folder, filename)
+    with Image.open(thumb_path) as img:
+        img = img.convert('RGB')
+        side = min(img.size)
+        left, top = (img.width - side) // 2, (img.height - side) // 2
+        return img.crop((left, top, left + side, top + side)).resize((SPRITE_CELL, SPRITE_CELL), Image.BICUBIC)
+
+def build_sprites(folder, key, names):
+    """Compose the sheets and offset map for one page; returns the map."""
+    sprite_dir = os.path.join(SPRITE_ROOT, folder)
+    os.makedirs(sprite_dir, exist_ok=True)
+
+    sheets, tiles = [], {}
+    for start in range(0, len(names), SPRITE_TILES):
+        chunk = names[start:start + SPRITE_TILES]
+        rows = (len(chunk) + SPRITE_COLUMNS - 1) // SPRITE_COLUMNS
+        columns = min(len(chunk), SPRITE_COLUMNS)
+        sheet = Image.new('RGB', (columns * SPRITE_CELL, rows * SPRITE_CELL), (17, 17, 17))
+        for i, name in enumerate(chunk):
+            x, y = (i % SPRITE_COLUMNS) * SPRITE_CELL, (i // SPRITE_COLUMNS) * SPRITE_CELL
+            try:
+                sheet.paste(sprite_tile(folder, name), (x, y))
+            except Exception as e:
+                app.logger.warning(f"Sprite tile failed for {name}: {e}")
+                continue  # the client falls back to the individual thumbnail
+            tiles[name] = [len(sheets), x, y]
+
+        sheet_name = f"{key}-{len(sheets)}.jpg"
+        save_image(sheet, os.path.join(sprite_dir, sheet_name), 'JPEG', quality=SPRITE_QUALITY, optimize=True)
+        sheets.append({'name': sheet_name, 'width': sheet.width, 'height': sheet.height})
+
+    sprite_map = {'cell': SPRITE_CELL, 'sheets': sheets, 'tiles': tiles}
+    write_atomic(os.path.join(sprite_dir, f"{key}.json"), json.dumps(sprite_map))
+    prune_sprites(folder)
+    return sprite_map
+
+def prune_sprites(folder):
+    """Keep the SPRITE_KEEP most recently used page maps and their sheets."""
+    sprite_dir = os.path.join(SPRITE_ROOT, folder)
+    try:
+        entries = list(os.scandir(sprite_dir))
+    except FileNotFoundError:
+        return
+    maps = sorted((e for e in entries if e.name.endswith('.json')),
+                  key=lambda e: e.stat().st_mtime, reverse=True)
+    kept = {e.name[:-len('.json')] for e in maps[:SPRITE_KEEP]}
+    now = time.time()
+    for entry in entries:
+        key = entry.name.lstrip('.').split('-', 1)[0].split('.', 1)[0]
+        try:
+            # Kept maps and their sheets stay, and so does anything a build may still be writing
+            if key in kept or now - entry.stat().st_mtime < 60:
+                continue
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+def sprite_ready(folder, names):
+    """[(name, thumb mtime_ns)] for names whose legacy thumbnail exists and is current."""
+    ready = []
+    for name in names:
+        try:
+            thumb = os.stat(os.path.join(THUMB_ROOT, folder, name))
+            source = os.stat(os.path.join(UPLOAD_ROOT, folder, name))
+        except OSError:
+            continue
+        if thumb.st_mtime >= source.st_mtime:
+            ready.append((name, thumb.st_mtime_ns))
+    return ready
+
+@app.route('/api/sprites')
+def api_sprites():
+    """Sprite sheets and offset map for the same page `/api/thumbnails` returns.
+
+    Takes the same `sort`/`limit`/`after` parameters. Tiles are
+    `[sheet index, x, y]` in pixels; images missing from `tiles` should use
+    their individual thumbnail.
+    """
+    config = load_config()
+    folder = config.get('current_folder')
+    if not folder or not os.path.isdir(os.path.join(UPLOAD_ROOT, folder)):
+        return jsonify({'cell': SPRITE_CELL, 'sheets': [], 'tiles': {}})
+
+    sort = request.args.get('sort', 'newest')
+    limit = request.args.get('limit', type=int)
+    cursor = request.args.get('after')
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except Exception:
+        return 'Invalid cursor', 400
+
+    library_index.ensure_folder(folder)
+    images, _ = library_index.page(folder, sort, limit if limit and limit > 0 else -1, after)
+    ready = sprite_ready(folder, images)
+    if not ready:
+        return jsonify({'cell': SPRITE_CELL, 'sheets': [], 'tiles': {}})
+
+    # Keyed on what the sheets contain, not the folder version, which every reshuffle bumps
+    versions = library_index.versions(folder, [name for name, _ in ready])
+    content = '/'.join(f"{name}|{versions.get(name)}|{mtime_ns}" for name, mtime_ns in ready)
+    key = hashlib.sha1(f"{SPRITE_CELL}|{SPRITE_QUALITY}|{content}".encode()).hexdigest()[:20]
+    if key in request.if_none_match:
+        return not_modified(key)
+
+    map_path = os.path.join(SPRITE_ROOT, folder, f"{key}.json")
+    try:
+        with open(map_path) as f:
+            sprite_map = json.load(f)
+        os.utime(map_path)  # mtime doubles as the LRU clock
+    except (OSError, ValueError):
+        # Concurrent Browse sessions share one build per page
+        try:
+            sprite_map = thumbnail_flight.do(('sprites', folder, key), build_sprites, folder, key,
+                                             [name for name, _ in ready])
+        except Exception as e:
+            app.logger.error(f"Failed to build sprites for {folder}: {e}")
+            sprite_map = None
+        if not sprite_map:
+            return jsonify({'cell': SPRITE_CELL, 'sheets': [], 'tiles': {}})
+
+    payload = dict(sprite_map, sheets=[
+        dict(sheet, url=url_for('serve_sprite', folder=folder, name=sheet['name']))
+        for sheet in sprite_map['sheets']
+    ])
+    return conditional_json(payload, key)
+
+@app.route('/sprites/<folder>/<name>')
+def serve_sprite(folder, name):
+    # Sheet names are content-addressed, so they never change once written
+    response = send_from_directory(os.path.join(SPRITE_ROOT, folder), name)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
 
 @app.route('/show', methods=['POST'])
 def show_image():
@@ -967,119 +3696,510 @@ def show_image():
     if not os.path.exists(image_path):
         return 'Image not found', 404
 
-    update_viewer_state(image_path, reset_delay=False)  # 👈 This now controls the timer reset
+    update_viewer_state(image_path, reset_delay=True)  # 👈 This now controls the timer reset
 
-    generate_thumbnail(folder, filename)
-    refresh_viewer()  # ✅ This is the missing nudge
+    generate_thumbnail(folder, filename, variants=())
+    thumb_variants.enqueue(folder, filename)
     return 'OK', 200
 
 
-def refresh_viewer():
-    try:
-        subprocess.run(['pkill', '-USR1', 'feh'], check=True)
-    except subprocess.CalledProcessError as e:
-        app.logger.warning(f"Failed to refresh viewer: {e}")
-
 @app.route('/config')
 def get_config():
     config = load_config()
-    return jsonify(config)
+    return jsonify(dict(config))
 
 @app.route('/restart', methods=['POST'])
 def restart_pi():
     splash_path = '/usr/share/plymouth/themes/pix/splash.png'
     update_symlink(splash_path)
     time.sleep(0.5)
-    subprocess.run(['sudo', 'reboot'])
+    run_command(['sudo', 'reboot'])
     return '', 204
 
-@app.route('/next_image')
-def next_image():
+def advance_slideshow(step=1):
+    """Move the current folder's playlist by step and show it; returns the image path."""
     config = load_config()
     folder = config.get('current_folder')
     if not folder:
-        return jsonify({'image': None})
+        return None
 
-    playlist_name = 'image_order.txt' if folder == 'main' else 'slideshow_list.txt'
-    order_path = os.path.join(BASE_DIR, playlist_name)
+    playlist.ensure(folder)
+    name = playlist.step(step)
+    if not name:
+        return None
 
-    try:
-        with open(order_path, 'r') as f:
-            images = [line.strip() for line in f if line.strip()]
-    except Exception as e:
-        app.logger.error(f"Error reading {playlist_name}: {e}")
-        return jsonify({'image': None})
+    image_path = os.path.join(UPLOAD_ROOT, folder, name)
+    update_viewer_state(image_path, reset_delay=True)
+    return image_path
 
-    if not images:
+@app.route('/next_image')
+def next_image():
+    if not advance_slideshow(1):
         return jsonify({'image': None})
+    return jsonify({'image': url_for('static', filename='current.jpg')})
 
-    try:
-        with open(os.path.join(BASE_DIR, 'static', 'current_image.txt')) as f:
-            current_name = f.read().strip()
-        idx = images.index(current_name)
-        next_idx = (idx + 1) % len(images)
-    except Exception as e:
-        app.logger.warning(f"Could not find current image in list: {e}")
-        next_idx = 0
 
-    image_path = os.path.join(UPLOAD_ROOT, folder, images[next_idx])
-    update_viewer_state(image_path, reset_delay=False)
+# --- In-process scheduler ---
+class Scheduler:
+    """Runs callbacks at deadlines on a single background thread.
+
+    Jobs live in a heap guarded by a condition variable: the thread sleeps
+    until the earliest deadline or until a job is added, so nothing polls.
+    """
+
+    def __init__(self, name='scheduler'):
+        self.name = name
+        self._cond = threading.Condition()
+        self._heap = []
+        self._entries = {}
+        self._seq = itertools.count()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def call_later(self, delay, callback, *args):
+        """Run callback(*args) after delay seconds; returns a handle for cancel().
+
+        Starts the thread on first use, so timers also fire in workers that
+        never ran start_slideshow (no scheduler lease).
+        """
+        self.start()
+        handle = next(self._seq)
+        entry = [time.monotonic() + delay, handle, callback, args]
+        with self._cond:
+            self._entries[handle] = entry
+            heapq.heappush(self._heap, entry)
+            self._cond.notify()
+        return handle
+
+    def cancel(self, handle):
+        with self._cond:
+            entry = self._entries.pop(handle, None)
+            if entry is not None:
+                entry[2] = None  # dropped lazily when it reaches the top of the heap
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    while self._heap and self._heap[0][2] is None:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0][0] - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                deadline, handle, callback, args = heapq.heappop(self._heap)
+                self._entries.pop(handle, None)
+
+            metrics.observe('frame_scheduler_lag_seconds', time.monotonic() - deadline,
+                            job=getattr(callback, '__name__', 'job'))
+            try:
+                callback(*args)
+            except Exception as e:
+                app.logger.error(f"Scheduled job {getattr(callback, '__name__', callback)} failed: {e}")
+
+
+class Slideshow:
+    """Advances the playlist every `delay` seconds via the shared scheduler."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.epoch = time.time()  # wall-clock start of the current slide interval
+        self._lock = threading.Lock()
+        self._handle = None
+
+    def reset(self):
+        """Restart the countdown; call after any manual transition or delay change.
+
+        Only the worker holding the scheduler lease runs the timer; elsewhere
+        this forwards the reset to it, and the owner broadcasts the new epoch.
+        """
+        if not scheduler_lease.owned:
+            self.epoch = time.time()
+            worker_bus.send({'type': 'reset'})
+            return
+
+        delay = load_config().get('delay', 1200)
+        with self._lock:
+            if self._handle is not None:
+                self.scheduler.cancel(self._handle)
+            self.epoch = time.time()
+            self._handle = self.scheduler.call_later(delay, self._tick)
+        worker_bus.send({'type': 'epoch', 'epoch': self.epoch})
+
+    def _tick(self):
+        # 🛑 Skip this tick if a deletion is in progress
+        if os.path.exists(os.path.join(BASE_DIR, 'deletion.lock')):
+            self.reset()
+            return
 
-    try:
-        with open(os.path.join(BASE_DIR, 'static', 'current_filename.txt'), 'w') as f:
-            f.write(os.path.basename(image_path))
-    except Exception as e:
-        app.logger.error(f"Failed to update current_filename.txt: {e}")
+        try:
+            advanced = advance_slideshow(1)
+        except Exception as e:
+            app.logger.warning(f"Slideshow failed to advance image: {e}")
+            advanced = None
+
+        if not advanced:
+            self.reset()  # nothing to show yet; keep ticking
+
+scheduler = Scheduler()
+slideshow = Slideshow(scheduler)
+
+
+# --- Multi-worker serving ---
+class WorkerBus:
+    """Datagram sockets linking the worker processes of one server.
+
+    Each worker binds RUN_DIR/worker-<pid>.sock and sends to every other one:
+    SSE events (so phones on any worker hear them), slideshow resets (acted on
+    by the scheduler owner) and the owner's new slide epoch. With a single
+    process there are no peers and send() does nothing.
+    """
+
+    def __init__(self, run_dir):
+        self.run_dir = run_dir
+        self.path = None
+        self.sock = None
+
+    def start(self):
+        if self.sock is not None:
+            return
+        os.makedirs(self.run_dir, exist_ok=True)
+        self.path = os.path.join(self.run_dir, f"worker-{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.path)
+        atexit.register(self._unlink, self.path)
+        self.prune()
+        threading.Thread(target=self._listen, name='worker-bus', daemon=True).start()
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def prune(self):
+        """Ping every peer once, dropping sockets left behind by workers that were killed."""
+        self.send({'type': 'ping'})
+
+    def peers(self):
+        try:
+            names = os.listdir(self.run_dir)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.run_dir, name) for name in names
+                if name.startswith('worker-') and name.endswith('.sock')
+                and os.path.join(self.run_dir, name) != self.path]
+
+    def send(self, message):
+        if self.sock is None:
+            return
+        payload = json.dumps(message).encode()
+        for peer in self.peers():
+            try:
+                self.sock.sendto(payload, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # The worker is gone; forget its socket
+                self._unlink(peer)
+            except OSError as e:
+                app.logger.warning(f"Worker bus send to {peer} failed: {e}")
+
+    def _listen(self):
+        while True:
+            try:
+                message = json.loads(self.sock.recv(65536))
+                kind = message.get('type')
+                if kind == 'event':
+                    broker.publish(message['event'], message['data'], relay=False)
+                elif kind == 'reset' and scheduler_lease.owned:
+                    slideshow.reset()
+                elif kind == 'epoch':
+                    slideshow.epoch = message['epoch']
+            except Exception as e:
+                app.logger.warning(f"Worker bus message failed: {e}")
+
+worker_bus = WorkerBus(RUN_DIR)
+
+class SchedulerLease:
+    """Exactly one worker drives the slideshow: whichever holds RUN_DIR/scheduler.lock.
+
+    The lock is held for the life of the process. Workers that miss it wait in
+    a background thread and take over if the owner exits. The owner records
+    its parent pid (the server), so a takeover within the same server can
+    tell itself apart from a fresh boot.
+    """
 
+    def __init__(self, run_dir):
+        self.path = os.path.join(run_dir, 'scheduler.lock')
+        self.marker_path = os.path.join(run_dir, 'scheduler.owner')
+        self.owned = False
+        self._file = None
+
+    def claim(self, on_acquire):
+        """Call on_acquire(first_owner) once this worker holds the lease."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            threading.Thread(target=self._wait, args=(on_acquire,), name='scheduler-lease', daemon=True).start()
+            return False
+        self._acquired(on_acquire)
+        return True
+
+    def _wait(self, on_acquire):
+        fcntl.flock(self._file, fcntl.LOCK_EX)
+        app.logger.info(f"Worker {os.getpid()} took over the slideshow scheduler")
+        self._acquired(on_acquire)
+
+    def _acquired(self, on_acquire):
+        self.owned = True
+        server = str(os.getppid())
+        try:
+            with open(self.marker_path) as f:
+                first = f.read().strip() != server
+        except OSError:
+            first = True
+        write_atomic(self.marker_path, server)
+        on_acquire(first)
+
+scheduler_lease = SchedulerLease(RUN_DIR)
+
+def sync_shared_state():
+    """Adopt the playlist and current image as another worker may have left them."""
+    global current_image_path
+    folder = load_config().get('current_folder')
+    if not folder:
+        return
+    playlist.ensure(folder)
+    name = playlist.current()
+    if name:
+        current_image_path = playlist.path(name)
+
+@app.before_request
+def before_request_sync():
+    if worker_bus.peers():
+        sync_shared_state()
+
+def start_slideshow(boot=True):
+    """Scheduler-owner startup: on boot reshuffle and show the first slide, then run the timer."""
     try:
-        Path(os.path.join(BASE_DIR, 'delay_updated.flag')).touch()
+        state_journal.recover()
     except Exception as e:
-        app.logger.error(f"Failed to touch delay_updated.flag: {e}")
+        app.logger.error(f"State journal recovery failed: {e}")
 
-    refresh_viewer()
-    return jsonify({'image': url_for('static', filename='current.jpg')})
+    images = None
+    if boot:
+        # Pick up anything that changed on disk while the server was down
+        threading.Thread(target=library_index.reconcile, name='reindex', daemon=True).start()
 
-def slideshow_loop():
-    last_flag_mtime = os.path.getmtime('/home/pi/frame-app/delay_updated.flag')
-    lock_path = os.path.join(BASE_DIR, 'deletion.lock')
+        images = regenerate_image_order()
+        logging.info("Shuffled 'main' at Flask launch.")
+    else:
+        sync_shared_state()
+    viewer.start()
+    ensure_clockd()
 
-    while True:
-        config = load_config()
-        delay = config.get('delay', 1200)
-
-        interrupted = False
-        for _ in range(delay):
-            time.sleep(1)
-            current_flag_mtime = os.path.getmtime('/home/pi/frame-app/delay_updated.flag')
-            if current_flag_mtime > last_flag_mtime:
-                last_flag_mtime = current_flag_mtime
-                interrupted = True
-                break  # restart sleep with new delay
-
-        if not interrupted:
-            # 🛑 Skip this tick if a deletion is in progress
-            if os.path.exists(lock_path):
+    # --- NEW: reset "current image" to first in the new random list ---
+    if images:
+        first_image = os.path.join(UPLOAD_ROOT, 'main', images[0])
+        update_viewer_state(first_image, reset_delay=True)
+
+    scheduler.start()
+    slideshow.reset()
+
+def create_app(boot=None):
+    """Application factory for several worker processes (without --preload), e.g.
+
+        gunicorn -w 4 -k gthread --threads 16 'app:create_app()'
+
+    Use a threaded or async worker class: each open Browse page holds a
+    thread on /events, and sync workers would be killed by the worker timeout
+    mid-stream. Under sync workers /events is switched off and pages poll.
+
+    Every worker joins the worker bus and runs the scheduler for its own
+    timers (e.g. clock stops); the one holding the scheduler lease also drives
+    the slideshow. `boot` forces (or skips) the start-up reshuffle;
+    by default only the first owner of a server run does it.
+    """
+    worker_bus.start()
+    scheduler.start()
+    scheduler_lease.claim(lambda first: start_slideshow(first if boot is None else boot))
+    return app
+
+# --- Maintenance ---
+THUMBS_CHECKPOINT_PATH = os.path.join(BASE_DIR, 'thumbs_rebuild.json')
+
+def _thumbnail_task(folder, filename):
+    return generate_thumbnail(folder, filename) is not None
+
+def plan_thumbnails(force_since=None):
+    """Walk UPLOAD_ROOT/THUMB_ROOT once; returns (missing or stale thumbs, orphaned thumb paths)."""
+    todo, orphans = [], []
+
+    sources_by_folder = {}
+    try:
+        folders = [e for e in os.scandir(UPLOAD_ROOT) if e.is_dir() and not e.name.startswith('.')]
+    except FileNotFoundError:
+        folders = []
+    for folder in folders:
+        sources_by_folder[folder.name] = {
+            e.name: e.stat().st_mtime for e in os.scandir(folder.path)
+            if is_image(e.name) and e.is_file()
+        }
+
+    try:
+        thumb_folders = [e for e in os.scandir(THUMB_ROOT) if e.is_dir() and not e.name.startswith('.')]
+    except FileNotFoundError:
+        thumb_folders = []
+    thumbs_by_folder, variants_by_folder = {}, {}
+    largest = thumb_sizes()[-1]
+    newest_format = thumb_formats()[-1] if thumb_formats() else None
+    for folder in thumb_folders:
+        thumbs = thumbs_by_folder[folder.name] = {}
+        sources = sources_by_folder.get(folder.name, {})
+        variants = variants_by_folder[folder.name] = {}
+        for entry in os.scandir(folder.path):
+            if entry.is_dir() and entry.name.isdigit():
+                # Size directory of WebP/AVIF variants: <width>/<filename>.<fmt>
+                for variant in os.scandir(entry.path):
+                    source_name, _, fmt = variant.name.rpartition('.')
+                    if variant.name.endswith('.tmp') or source_name not in sources:
+                        orphans.append(variant.path)
+                    elif int(entry.name) == largest and fmt == newest_format:
+                        variants[source_name] = variant.stat().st_mtime
+                continue
+            if not entry.is_file():
                 continue
+            if entry.name.startswith('.') and entry.name.endswith('.tmp'):
+                orphans.append(entry.path)  # left behind by an interrupted write
+            elif not entry.name.startswith('.'):
+                if entry.name in sources:
+                    thumbs[entry.name] = entry.stat().st_mtime
+                elif is_image(entry.name):
+                    orphans.append(entry.path)
+
+    for folder, sources in sources_by_folder.items():
+        thumbs = thumbs_by_folder.get(folder, {})
+        variants = variants_by_folder.get(folder, {})
+        for name, mtime in sources.items():
+            thumb_mtime = thumbs.get(name)
+            if newest_format and thumb_mtime is not None:
+                # One variant stands in for the set; a missing one makes the thumb stale
+                thumb_mtime = variants.get(name) and min(thumb_mtime, variants[name])
+            if (thumb_mtime is None or thumb_mtime < mtime
+                    or (force_since is not None and thumb_mtime < force_since)):
+                todo.append((folder, name))
+    return todo, orphans
+
+def backfill_thumbnails(rebuild=True, force=False, workers=None):
+    """Regenerate missing/stale thumbnails across a process pool and remove orphans.
+
+    Up-to-date thumbnails are skipped and writes are atomic, so an interrupted
+    run simply resumes. A --force run records its start time in a checkpoint
+    so a restart only redoes thumbnails older than the original start.
+    """
+    force_since = None
+    if force:
+        try:
+            with open(THUMBS_CHECKPOINT_PATH) as f:
+                force_since = json.load(f)['started']
+            logging.info("Resuming interrupted forced rebuild")
+        except Exception:
+            force_since = time.time()
+            if rebuild:
+                write_atomic(THUMBS_CHECKPOINT_PATH, json.dumps({'started': force_since}))
 
-            try:
-                requests.get('http://localhost:5000/next_image')
-            except Exception as e:
-                app.logger.warning(f"Slideshow loop failed to advance image: {e}")
+    todo, orphans = plan_thumbnails(force_since)
+    logging.info(f"{len(todo)} thumbnails to generate, {len(orphans)} orphans")
+    if not rebuild:
+        return {'pending': len(todo), 'orphans': len(orphans)}
+
+    removed = 0
+    for path in orphans:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            logging.warning(f"Could not remove orphan {path}: {e}")
+
+    done, failed, ready = 0, 0, []
+    started = last_report = time.perf_counter()
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            futures = {pool.submit(_thumbnail_task, folder, name): (folder, name) for folder, name in todo}
+            for future in as_completed(futures):
+                if future.exception() is None and future.result():
+                    done += 1
+                    ready.append(futures[future])
+                else:
+                    failed += 1
+                if len(ready) >= 500:
+                    library_index.set_thumb_states(ready, 'ready')
+                    ready = []
+
+                now = time.perf_counter()
+                if now - last_report >= 5:
+                    last_report = now
+                    rate = (done + failed) / (now - started)
+                    logging.info(f"{done + failed}/{len(todo)} thumbnails ({rate:.1f}/s)")
+    library_index.set_thumb_states(ready, 'ready')
+
+    elapsed = time.perf_counter() - started
+    rate = done / elapsed if elapsed else 0.0
+    if force:
+        try:
+            os.remove(THUMBS_CHECKPOINT_PATH)
+        except FileNotFoundError:
+            pass
+    logging.info(f"Generated {done} thumbnails in {elapsed:.1f}s ({rate:.1f}/s), "
+                 f"{failed} failed, {removed} orphans removed")
+    return {'generated': done, 'failed': failed, 'orphans_removed': removed,
+            'seconds': round(elapsed, 2), 'per_second': round(rate, 2)}
+
+def run_cli(argv):
+    """Handle maintenance subcommands; returns False when the server should start."""
+    parser = argparse.ArgumentParser(description="Photo frame server and maintenance commands")
+    commands = parser.add_subparsers(dest='command')
+
+    reindex = commands.add_parser('reindex', help="reconcile the library index with files on disk")
+    reindex.add_argument('folder', nargs='?', help="only this slideshow folder")
+
+    commands.add_parser('clockd', help="run the warm fork server for clock and billboard scripts")
+
+    thumbs = commands.add_parser('thumbs', help="report or rebuild missing/stale thumbnails")
+    thumbs.add_argument('--rebuild', action='store_true', help="generate missing/stale thumbs and delete orphans")
+    thumbs.add_argument('--force', action='store_true', help="regenerate every thumbnail")
+    thumbs.add_argument('--workers', type=int, help="worker processes (default: CPU count)")
+
+    args = parser.parse_args(argv)
+    if args.command == 'reindex':
+        started = time.perf_counter()
+        totals = library_index.reconcile(args.folder)
+        logging.info(f"Reindexed in {time.perf_counter() - started:.1f}s: {totals}")
+        return True
+    if args.command == 'thumbs':
+        backfill_thumbnails(rebuild=args.rebuild, force=args.force, workers=args.workers)
+        return True
+    if args.command == 'clockd':
+        ClockDaemon().serve_forever()
+        return True
+    return False
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO)
+    if run_cli(sys.argv[1:]):
+        sys.exit(0)
 
-    regenerate_image_order()
-    logging.info("Shuffled 'main' at Flask launch.")
-
-    # --- NEW: reset "current image" to first in the new random list ---
-    order_path = os.path.join(BASE_DIR, 'image_order.txt')
-    if os.path.exists(order_path):
-        with open(order_path) as f:
-            images = [line.strip() for line in f if line.strip()]
-        if images:
-            first_image = os.path.join(UPLOAD_ROOT, 'main', images[0])
-            update_viewer_state(first_image, reset_delay=True)
-
-    threading.Thread(target=slideshow_loop, daemon=True).start()
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
\ No newline at end of file
+    create_app(boot=True).run(host='0.0.0.0', port=5000, debug=False, use_reloader=False)
\ No newline at end of file
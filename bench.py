@@ -0,0 +1,253 @@
+"""Micro-benchmarks for the frame's hot paths.
+
+Run with `python bench.py`; results are printed and written to
+bench_output.txt as one JSON object per line, tagged with the git commit
+so runs can be compared across commits.
+
+The library benchmarks build a synthetic photo library (1k/10k/50k JPEGs by
+default) in a temp directory, point the app at it with FRAME_BASE_DIR and
+put stub feh/pkill/xdotool/vcgencmd scripts first on PATH. Each library size
+runs in its own interpreter so the app's module state starts cold.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+OUTPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_output.txt')
+
+# Camera-like frame sizes and the EXIF orientations correct_orientation handles
+PHOTO_SIZES = ((4032, 3024), (3024, 4032), (4000, 3000), (6000, 4000), (2048, 1536), (1920, 1080))
+ORIENTATIONS = (1, 3, 6, 8)
+STUB_COMMANDS = {
+    # feh must stay up and survive SIGUSR1 like the real viewer (ignored signals outlive exec)
+    'feh': "#!/bin/sh\ntrap '' USR1\nexec sleep 86400\n",
+    'pkill': "#!/bin/sh\nexit 0\n",
+    'xdotool': "#!/bin/sh\nexit 0\n",
+    'vcgencmd': "#!/bin/sh\necho 'display_power=1'\n",
+}
+
+
+def timed(fn, repeat=5):
+    """Best and median wall time of `repeat` calls."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return min(samples), statistics.median(samples)
+
+
+def result(bench, n, best, median, **extra):
+    return dict({'bench': bench, 'n': n, 'best_s': round(best, 4), 'median_s': round(median, 4)}, **extra)
+
+
+def bench_weighted_shuffle(n):
+    """Weights plus permutation for n photos, half of them inside the recency window."""
+    import app
+
+    now = time.time()
+    mtimes = [now - random.uniform(0, 180 * 86400) for _ in range(n)]
+
+    results = []
+    backends = [('numpy', app.np), ('python', None)] if app.np is not None else [('python', None)]
+    for backend, module in backends:
+        saved, app.np = app.np, module
+        try:
+            best, median = timed(lambda: app.weighted_permutation(app.shuffle_weights(mtimes, now, 0.6, 90)))
+        finally:
+            app.np = saved
+        results.append(result('weighted_shuffle', n, best, median, backend=backend))
+    return results
+
+
+# --- Synthetic library ---
+def make_templates(template_dir):
+    """One JPEG per (size, orientation): smooth noise at camera resolution, a few hundred KB to a few MB."""
+    from PIL import Image
+
+    templates = []
+    now = time.time()
+    for width, height in PHOTO_SIZES:
+        for orientation in ORIENTATIONS:
+            small = (max(width // 16, 1), max(height // 16, 1))
+            bands = [Image.effect_noise(small, 48), Image.linear_gradient('L').resize(small), Image.effect_noise(small, 96)]
+            img = Image.merge('RGB', bands).resize((width, height), Image.BILINEAR)
+
+            taken = now - random.uniform(0, 3 * 365 * 86400)
+            exif = Image.Exif()
+            exif[0x0112] = orientation
+            exif[0x0132] = time.strftime('%Y:%m:%d %H:%M:%S', time.localtime(taken))
+            path = os.path.join(template_dir, f"template-{width}x{height}-o{orientation}.jpg")
+            img.save(path, 'JPEG', quality=88, exif=exif.tobytes())
+            os.utime(path, (taken, taken))
+            templates.append(path)
+    return templates
+
+
+def build_library(base_dir, n):
+    """static/uploads/main with n photos, hard-linked to the templates so 50k stays cheap on disk.
+
+    Links share their template's inode, so the library has as many distinct
+    mtimes as there are templates; sorts and shuffles do the same work either way.
+    """
+    template_dir = os.path.join(base_dir, 'templates')
+    folder = os.path.join(base_dir, 'static', 'uploads', 'main')
+    os.makedirs(template_dir)
+    os.makedirs(folder)
+    os.makedirs(os.path.join(base_dir, 'static', 'thumbs', 'main'))
+
+    templates = make_templates(template_dir)
+    for i in range(n):
+        source = templates[i % len(templates)]
+        target = os.path.join(folder, f"IMG_{i:05d}.jpg")
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+    with open(os.path.join(base_dir, 'config.json'), 'w') as f:
+        json.dump({'current_folder': 'main', 'delay': 1200, 'screen_geometry': '1920x1080'}, f)
+    return templates
+
+
+def install_stubs(base_dir):
+    """Stub viewer/X/firmware commands in base_dir/bin; returns the PATH that puts them first."""
+    bin_dir = os.path.join(base_dir, 'bin')
+    os.makedirs(bin_dir)
+    for name, script in STUB_COMMANDS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, 'w') as f:
+            f.write(script)
+        os.chmod(path, 0o755)
+    return bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+
+# --- Library benchmarks (child process, FRAME_BASE_DIR already set) ---
+def bench_library(n, repeat):
+    import app
+
+    results = []
+    client = app.app.test_client()
+
+    # Cold index build, as after a fresh install or a lost library.db
+    start = time.perf_counter()
+    app.library_index.reconcile('main')
+    elapsed = time.perf_counter() - start
+    results.append(result('library_reconcile', n, elapsed, elapsed))
+
+    for weighted in (False, True):
+        app.config_store.update(weighted_shuffle=weighted)
+        best, median = timed(app.regenerate_image_order, repeat)
+        results.append(result('regenerate_image_order', n, best, median, weighted=weighted))
+
+    # A custom order over 90% of the library, so the unordered tail is listed too
+    names = app.library_index.sorted_names('main', 'az')
+    custom = random.sample(names, int(len(names) * 0.9))
+
+    def save_custom():
+        response = client.post('/save-custom-order', json={'folder': 'main', 'order': custom})
+        assert response.status_code == 200, response.status_code
+
+    best, median = timed(save_custom, repeat)
+    results.append(result('save_custom_order', n, best, median))
+
+    # 'random' reads the order regenerate_image_order stored above
+    for sort in list(app.LibraryIndex.KEYSET) + ['custom', 'random']:
+        for limit in (200, None):
+            url = f"/api/thumbnails?sort={sort}" + (f"&limit={limit}" if limit else '')
+
+            def fetch():
+                response = client.get(url)
+                assert response.status_code == 200, response.status_code
+
+            best, median = timed(fetch, repeat)
+            results.append(result('api_thumbnails', n, best, median, sort=sort, limit=limit))
+
+    # One photo per template, so every size and orientation is decoded
+    sample = [f"IMG_{i:05d}.jpg" for i in range(min(n, len(PHOTO_SIZES) * len(ORIENTATIONS)))]
+    # The request/upload path writes the JPEG only; backfill writes every WebP/AVIF variant too
+    for variants, label in (((), 'none'), (None, 'all')):
+        best, median = timed(lambda: [app.generate_thumbnail('main', name, variants=variants) for name in sample], repeat)
+        results.append(result('generate_thumbnail', n, best / len(sample), median / len(sample),
+                              per='image', variants=label))
+
+    # Last, since it starts display-cache and prefetch work in the background
+    app.viewer._find_feh = lambda: []  # launch the stub, never adopt a real viewer
+    app.viewer.start()
+    try:
+        steps = 20
+
+        def advance():
+            for _ in range(steps):
+                response = client.get('/next_image')
+                assert response.status_code == 200, response.status_code
+
+        best, median = timed(advance, repeat)
+        results.append(result('next_image', n, best / steps, median / steps, per='request'))
+    finally:
+        if app.viewer.main_process is not None:
+            app.viewer.main_process.kill()
+    return results
+
+
+def run_library(n, repeat, keep=False):
+    """Build a library of n photos in a temp BASE_DIR and benchmark it in a fresh interpreter."""
+    base_dir = tempfile.mkdtemp(prefix=f'frame-bench-{n}-')
+    try:
+        build_library(base_dir, n)
+        env = dict(os.environ, FRAME_BASE_DIR=base_dir, PATH=install_stubs(base_dir))
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--library', str(n), '--repeat', str(repeat)],
+                                env=env, stdout=subprocess.PIPE, check=True, text=True).stdout
+        return [json.loads(line) for line in output.splitlines() if line.startswith('{')]
+    finally:
+        if keep:
+            print(f"Kept {base_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(base_dir, ignore_errors=True)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 50_000],
+                        help='library sizes to generate')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--keep', action='store_true', help='leave the generated libraries in place')
+    parser.add_argument('--library', type=int, help=argparse.SUPPRESS)  # child mode, see run_library
+    args = parser.parse_args()
+
+    if args.library is not None:
+        for entry in bench_library(args.library, args.repeat):
+            print(json.dumps(entry), flush=True)
+        return
+
+    results = []
+    for n in (1_000, 10_000, 100_000):
+        results += bench_weighted_shuffle(n)
+    for n in args.sizes:
+        results += run_library(n, args.repeat, args.keep)
+
+    commit, stamp = git_commit(), time.strftime('%Y-%m-%dT%H:%M:%S')
+    with open(OUTPUT_PATH, 'w') as f:
+        for entry in results:
+            line = json.dumps(dict(entry, commit=commit, at=stamp))
+            print(line)
+            f.write(line + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import os
+import tempfile
+import threading
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('PIL')
+
+# The app reads its paths at import time
+os.environ.setdefault('FRAME_BASE_DIR', tempfile.mkdtemp(prefix='frame-test-'))
+
+import app  # noqa: E402
+
+
+class FakeProcess:
+    def __init__(self):
+        self.terminated = threading.Event()
+
+    def poll(self):
+        return 0 if self.terminated.is_set() else None
+
+    def terminate(self):
+        self.terminated.set()
+
+    def wait(self, timeout=None):
+        return 0
+
+
+def test_cold_start_clock_is_stopped_without_the_scheduler_lease(monkeypatch):
+    """A worker that never ran start_slideshow still stops its fallback clock."""
+    scheduler = app.Scheduler()
+    monkeypatch.setattr(app, 'scheduler', scheduler)
+    monkeypatch.setattr(app.scheduler_lease, 'owned', False)
+    monkeypatch.setattr(app, 'clockd_request', lambda message, timeout=2.0: None)
+    monkeypatch.setattr(app, 'ensure_clockd', lambda: None)
+    process = FakeProcess()
+    monkeypatch.setattr(app, 'spawn_command', lambda *args, **kwargs: process)
+
+    app.start_clock('clock.py', [], duration_minutes=0.001)
+
+    assert process.terminated.wait(5), "fallback clock was never stopped"
+    assert app.clock_process is None
+    assert app.clock_timer is None